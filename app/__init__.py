@@ -1,23 +1,75 @@
-from flask import Flask
+import logging
+import sys
+
+from flask import Flask, current_app
 from flask_login import LoginManager
-from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
 from config import Config
-from flask_uploads import UploadSet, configure_uploads, IMAGES, patch_request_class
-import os
-
-app = Flask(__name__)
-app.config.from_object(Config)
-bootstrap = Bootstrap(app)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-login = LoginManager(app)
-login.login_view = 'login'
+from flask_uploads import UploadSet, configure_uploads, IMAGES
+from werkzeug.local import LocalProxy
+from app.cache import Cache, MemoryBackend
+from app.database import RoutingSQLAlchemy
+
+bootstrap = Bootstrap()
+db = RoutingSQLAlchemy()
+login = LoginManager()
+login.login_view = 'main.login'
 photos = UploadSet('photos', IMAGES)
-configure_uploads(app, photos)
-patch_request_class(app)
-moment = Moment(app)
+moment = Moment()
+
+
+def per_app(name):
+    # stands for the current app's own instance, which create_app keeps in
+    # app.extensions, so two apps never share contents or threads
+    return LocalProxy(lambda: current_app.extensions[name])
+
+
+user_cache = per_app('user_cache')
+fragment_cache = per_app('fragment_cache')
+unread_cache = per_app('unread_cache')
+
+
+def create_app(config_class=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    bootstrap.init_app(app)
+    db.init_app(app)
+    login.init_app(app)
+    configure_uploads(app, photos)
+    moment.init_app(app)
+    app.extensions['user_cache'] = Cache(MemoryBackend(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL']))
+    app.extensions['fragment_cache'] = Cache(MemoryBackend(app.config['FRAGMENT_CACHE_SIZE'],
+                                                           app.config['FRAGMENT_CACHE_TTL']))
+    app.extensions['unread_cache'] = Cache(MemoryBackend(app.config['UNREAD_CACHE_SIZE'],
+                                                         app.config['UNREAD_CACHE_TTL']))
+    # Alembic is a large import only the flask db commands need. The flask
+    # CLI loads them before it creates the app, web workers and tests never do.
+    if 'flask_migrate.cli' in sys.modules:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    from app import routes, errors, api, cli, instrumentation
+    from app.explore import ExploreFeed
+    from app.notifications import NotificationQueue
+    from app.search import SearchIndex
+    from app.suggestions import SuggestionGraph
+    app.extensions['explore_feed'] = ExploreFeed()
+    app.extensions['notification_queue'] = NotificationQueue()
+    app.extensions['search_index'] = SearchIndex()
+    app.extensions['suggestion_graph'] = SuggestionGraph()
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(errors.bp)
+    app.register_blueprint(api.bp, url_prefix='/api/v1')
+    app.register_blueprint(cli.bp)
+    app.register_blueprint(instrumentation.bp)
+    if app.config['INSTRUMENTATION'] and app.config['REQUEST_LOG'] and not instrumentation.request_logger.handlers:
+        # the per request JSON lines are INFO, which nothing logs by default
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        instrumentation.request_logger.addHandler(handler)
+        instrumentation.request_logger.propagate = False
+    return app
+
 
-from app import routes, models, errors
+from app import models
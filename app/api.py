@@ -0,0 +1,118 @@
+import hashlib
+import json
+
+from flask import Blueprint, current_app, request, url_for
+from flask_login import current_user
+from sqlalchemy.orm import joinedload
+
+from app import db, timeline
+from app.explore import explore_feed
+from app.models import Comment, Post, PostLike, User
+from app.pagination import paginate_keyset
+
+# Version 1 of the JSON API: the home, explore and user feeds as compact post
+# records, and paged comment threads. Every feed response carries a strong
+# ETag computed from the page before anything is serialized, so a client
+# polling with If-None-Match pays for one page query and gets an empty 304
+# while nothing has changed.
+
+bp = Blueprint('api', __name__)
+
+
+@bp.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return json_response({'error': 'login required'}, 401)
+
+
+def json_response(data, status=200):
+    return current_app.response_class(json.dumps(data, separators=(',', ':')), status, mimetype='application/json')
+
+
+def feed_etag(posts, next_url, prev_url):
+    # likes, comments and author profile changes all bump Post.version, and
+    # the viewer is included because "liked" differs between viewers
+    state = [current_user.id, next_url, prev_url] + [(post.id, post.timestamp.isoformat(), post.version)
+                                                      for post in posts]
+    return hashlib.sha1(json.dumps(state).encode()).hexdigest()
+
+
+def serialize_posts(posts):
+    ids = [post.id for post in posts]
+    if not ids:
+        return []
+    authors = {user.id: user for user in User.query.filter(User.id.in_({post.user_id for post in posts}))}
+    liked = {post_id for post_id, in db.session.query(PostLike.post_id).filter(
+        PostLike.user_id == current_user.id, PostLike.post_id.in_(ids))}
+    records = []
+    for post in posts:
+        author = authors.get(post.user_id)
+        records.append({'id': post.id, 'author': author.username if author else None, 'text': post.post_details,
+                        'timestamp': post.timestamp.isoformat() + 'Z', 'likes': post.like_count,
+                        'comments': post.comment_count, 'liked': post.id in liked})
+    return records
+
+
+def feed_response(posts, next_url, prev_url):
+    etag = feed_etag(posts, next_url, prev_url)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = json_response({'posts': serialize_posts(posts), 'next': next_url, 'prev': prev_url})
+    response.set_etag(etag)
+    # clients may keep the page but have to revalidate it on every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def keyset_feed(query, endpoint, columns=(Post.timestamp, Post.id), **kwargs):
+    page = paginate_keyset(query, current_app.config['POSTS_PER_PAGE'], after=request.args.get('after'),
+                           before=request.args.get('before'), columns=columns)
+    next_url = url_for(endpoint, after=page.next_cursor, **kwargs) if page.has_next else None
+    prev_url = url_for(endpoint, before=page.prev_cursor, **kwargs) if page.has_prev else None
+    return feed_response(page.items, next_url, prev_url)
+
+
+@bp.route('/feed')
+@db.replica()
+def home_feed():
+    return keyset_feed(timeline.home_posts(current_user), 'api.home_feed', timeline.home_keys())
+
+
+@bp.route('/explore')
+@db.replica()
+def explore_posts():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['POSTS_PER_PAGE']
+    ranked = explore_feed.ranked_ids()
+    ids = ranked[(page - 1) * per_page:page * per_page]
+    by_id = {post.id: post for post in Post.query.filter(Post.id.in_(ids))} if ids else {}
+    next_url = url_for('api.explore_posts', page=page + 1) if page * per_page < len(ranked) else None
+    prev_url = url_for('api.explore_posts', page=page - 1) if page > 1 else None
+    return feed_response([by_id[id] for id in ids if id in by_id], next_url, prev_url)
+
+
+@bp.route('/user/<username>/posts')
+@db.replica()
+def user_posts(username):
+    user = User.query.filter_by(username=username.lower()).first()
+    if user is None:
+        return json_response({'error': 'not found'}, 404)
+    return keyset_feed(user.posts.order_by(Post.timestamp.desc()), 'api.user_posts', username=user.username)
+
+
+@bp.route('/post/<int:post_id>/comments')
+@db.replica()
+def post_comments(post_id):
+    post = Post.query.get(post_id)
+    if post is None:
+        return json_response({'error': 'not found'}, 404)
+    page = paginate_keyset(post.get_comments().options(joinedload(Comment.author)),
+                           current_app.config['COMMENTS_PER_PAGE'], after=request.args.get('after'),
+                           before=request.args.get('before'), columns=(Comment.timestamp, Comment.id))
+    next_url = url_for('api.post_comments', post_id=post.id, after=page.next_cursor) if page.has_next else None
+    prev_url = url_for('api.post_comments', post_id=post.id, before=page.prev_cursor) if page.has_prev else None
+    comments = [{'id': comment.id, 'author': comment.author.username if comment.author else None,
+                 'text': comment.body, 'timestamp': comment.timestamp.isoformat() + 'Z'} for comment in page.items]
+    return json_response({'comments': comments, 'next': next_url, 'prev': prev_url})
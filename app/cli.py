@@ -0,0 +1,70 @@
+import click
+from flask import Blueprint
+
+from app import db, timeline, seed as seed_data
+from app.models import reconcile_counters
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.group('timeline')
+def timeline_group():
+    """Materialized home timeline commands."""
+    pass
+
+
+@timeline_group.command()
+@click.option('--user', 'user_ids', type=int, multiple=True, help='Only rebuild these user ids.')
+def rebuild(user_ids):
+    """Backfill or rebuild the push timelines from the followers table."""
+    timeline.rebuild(list(user_ids))
+    db.session.commit()
+    click.echo('Timeline rebuilt for {}.'.format(
+        'users {}'.format(', '.join(map(str, user_ids))) if user_ids else 'all users'))
+
+
+@bp.cli.group()
+def counters():
+    """Denormalized like, comment and follower counter commands."""
+    pass
+
+
+@counters.command()
+def reconcile():
+    """Recount all counters from their source tables and fix any drift."""
+    fixed = reconcile_counters()
+    db.session.commit()
+    for counter, rows in sorted(fixed.items()):
+        click.echo('{}: {} row(s) fixed'.format(counter, rows))
+
+
+@bp.cli.group()
+def seed():
+    """Bulk data import commands."""
+    pass
+
+
+@seed.command('load')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--reset', is_flag=True, help='Delete all existing rows first.')
+@click.option('--drop-indexes', is_flag=True, help='Drop non-unique indexes while loading and rebuild them after.')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per executemany and commit.')
+@click.option('--hash-workers', type=int, help='Processes hashing passwords, one per CPU by default, 0 for none.')
+def load(paths, reset, drop_indexes, batch_size, hash_workers):
+    """Import users, events, posts, follows, likes, comments, attendees and
+    notifications from <name>.jsonl or <name>.csv files or directories."""
+    try:
+        sources = seed_data.find_sources(paths)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if reset:
+        seed_data.reset()
+    counts = seed_data.load(sources, batch_size, hash_workers, drop_indexes, log=click.echo)
+    click.echo('Loaded {} rows.'.format(sum(counts.values())))
+
+
+@seed.command()
+def demo():
+    """Replace all data with the small demo data set."""
+    seed_data.reset()
+    seed_data.load(seed_data.DEMO, hash_workers=0, log=click.echo)
@@ -0,0 +1,80 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from flask import has_request_context, session as user_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import CompoundSelect, Select
+
+REPLICA = 'replica'
+# kept in the user's Flask session: until then their reads skip the replica
+PRIMARY_UNTIL = 'primary_until'
+
+
+class RoutingSession(SignallingSession):
+    # While session.info['replica'] is set, plain SELECTs go to the replica
+    # bind when one is configured. Flushes, bulk updates and every other
+    # statement stay on the primary, as do reads in a transaction that has
+    # written. A user whose request committed a write reads from the primary
+    # for REPLICA_STICKY_SECONDS afterwards, so the page they are redirected
+    # to shows their change despite replica lag.
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif self.info.get(REPLICA) and isinstance(clause, (Select, CompoundSelect)) \
+                and REPLICA in (self.app.config['SQLALCHEMY_BINDS'] or ()) and not self.info.get('wrote') \
+                and not recently_wrote():
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, 'after_commit', _stick_to_primary)
+        event.listen(factory, 'after_rollback', _forget_writes)
+        return factory
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = SQLAlchemy.create_engine(self, sa_url, engine_opts)
+        pragmas = self.get_app().config['SQLITE_PRAGMAS']
+        if engine.dialect.name == 'sqlite' and pragmas:
+            event.listen(engine, 'connect', lambda connection, record: set_pragmas(connection, pragmas))
+        return engine
+
+    @contextmanager
+    def replica(self):
+        # reads inside the block (or the decorated view) may be served by the
+        # replica; see RoutingSession for when they stay on the primary
+        info = self.session.info
+        previous = info.get(REPLICA, False)
+        info[REPLICA] = True
+        try:
+            yield
+        finally:
+            info[REPLICA] = previous
+
+
+def recently_wrote():
+    return has_request_context() and user_session.get(PRIMARY_UNTIL, 0) > time.time()
+
+
+def _stick_to_primary(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        user_session[PRIMARY_UNTIL] = time.time() + session.app.config['REPLICA_STICKY_SECONDS']
+
+
+def _forget_writes(session):
+    session.info.pop('wrote', None)
+
+
+def set_pragmas(connection, pragmas):
+    if not isinstance(connection, sqlite3.Connection):
+        return
+    cursor = connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db, per_app
+from app.models import Comment, Post, PostLike
+from app.snapshots import PeriodicRefresh
+
+
+class ExploreFeed(PeriodicRefresh):
+    # The explore page is the same for every viewer, so the ranking is
+    # computed at most once per EXPLORE_REFRESH_INTERVAL and every request
+    # reads the current snapshot. A refresh builds a new tuple and swaps it in
+    # with a single assignment, so readers never see a half-built list.
+
+    thread_name = 'explore-refresh'
+    interval_setting = 'EXPLORE_REFRESH_INTERVAL'
+    background_setting = 'EXPLORE_BACKGROUND_REFRESH'
+
+    def __init__(self):
+        PeriodicRefresh.__init__(self)
+        self.post_ids = ()
+
+    def ranked_ids(self):
+        self.ensure_fresh()
+        return self.post_ids
+
+    def build(self):
+        self.post_ids = tuple(rank_posts(current_app.config))
+
+
+def rank_posts(config, now=None):
+    # Ranks the newest EXPLORE_CANDIDATES posts by recent activity, decayed by
+    # age: (1 + likes + 2 * comments) / (age in hours + 2) ** EXPLORE_GRAVITY,
+    # where likes and comments only count inside EXPLORE_ACTIVITY_WINDOW.
+    now = now or datetime.utcnow()
+    since = now - timedelta(hours=config['EXPLORE_ACTIVITY_WINDOW'])
+    candidates = db.session.query(Post.id, Post.timestamp).order_by(Post.timestamp.desc()).limit(
+        config['EXPLORE_CANDIDATES']).all()
+    if not candidates:
+        return []
+    ids = [id for id, _ in candidates]
+    activity = dict.fromkeys(ids, 1.0)
+    likes = db.session.query(PostLike.post_id, db.func.count(PostLike.id)).filter(
+        PostLike.post_id.in_(ids), PostLike.timestamp >= since).group_by(PostLike.post_id)
+    for post_id, count in likes:
+        activity[post_id] += count
+    comments = db.session.query(Comment.post_id, db.func.count(Comment.id)).filter(
+        Comment.post_id.in_(ids), Comment.timestamp >= since).group_by(Comment.post_id)
+    for post_id, count in comments:
+        activity[post_id] += 2 * count
+
+    def score(candidate):
+        id, timestamp = candidate
+        age = max((now - timestamp).total_seconds() / 3600, 0)
+        return activity[id] / (age + 2) ** config['EXPLORE_GRAVITY'], timestamp, id
+
+    return [id for id, _ in sorted(candidates, key=score, reverse=True)]
+
+
+explore_feed = per_app('explore_feed')
@@ -65,12 +65,13 @@ class PostForm(FlaskForm):
 
 
 class EventForm(FlaskForm):
-    name = TextAreaField('Event Name', validators=[DataRequired()])
-    date = DateTimeField('Event Date', format='%m/%d/%Y', validators=[DataRequired])
+    name = TextAreaField('Event Name', validators=[DataRequired(), Length(max=64)])
+    location = StringField('Location', validators=[DataRequired(), Length(max=120)])
+    date = DateTimeField('Event Date', format='%m/%d/%Y', validators=[DataRequired()])
     # image
     submit = SubmitField('Submit')
 
 
 class CommentForm(FlaskForm):
-    body = StringField("Post", validators=[DataRequired])
+    body = StringField("Post", validators=[DataRequired()])
     submit = SubmitField("Submit")
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def stream_to_disk(stream, dest, max_size):
+    # Copies the upload to a temporary file in dest in chunks while hashing
+    # it, and gives up as soon as more than max_size bytes have arrived.
+    # Returns the temporary path and the sha256 of the content.
+    os.makedirs(dest, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=dest, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise ImageTooLarge()
+                digest.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+def variant_path(path, name):
+    # variants sit next to the original, named after its content hash
+    return os.path.join(os.path.dirname(path), '{}_{}.jpg'.format(os.path.basename(path).split('.', 1)[0], name))
+
+
+def make_variants(path, variants):
+    # Runs in a worker process. Pillow is only needed here, so the web
+    # workers never import it.
+    from PIL import Image
+
+    written = []
+    with Image.open(path) as original:
+        image = original.convert('RGB')
+    for name, size in sorted(variants.items()):
+        variant = image.copy()
+        variant.thumbnail(size)
+        target = variant_path(path, name)
+        if not os.path.exists(target):
+            # write then rename so readers never see a half-written file
+            tmp_path = target + '.tmp'
+            variant.save(tmp_path, 'JPEG', quality=85, optimize=True, progressive=True)
+            os.replace(tmp_path, target)
+        written.append(target)
+    return written
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'])
+        return _pool
+
+
+def process_async(path):
+    # Hands resizing and re-encoding to the process pool and returns straight
+    # away. With IMAGE_WORKERS = 0 the work is done inline, which is what the
+    # tests use.
+    config = current_app.config
+    if not config['IMAGE_WORKERS']:
+        return make_variants(path, config['IMAGE_VARIANTS'])
+    logger = current_app.logger
+    future = get_pool().submit(make_variants, path, config['IMAGE_VARIANTS'])
+
+    def log_failure(future):
+        if future.exception() is not None:
+            logger.error('Processing image %s failed: %r', path, future.exception())
+
+    future.add_done_callback(log_failure)
+    return future
@@ -0,0 +1,135 @@
+import heapq
+import json
+import logging
+import threading
+import time
+
+from flask import Blueprint, current_app, g, has_request_context, jsonify, abort, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+bp = Blueprint('instrumentation', __name__)
+request_logger = logging.getLogger('app.requests')
+request_logger.setLevel(logging.INFO)
+STATEMENT_LENGTH = 500
+
+
+class EndpointStats(object):
+    # Running totals per endpoint plus the slowest statements seen on it,
+    # kept in a bounded min-heap of (duration, statement).
+
+    def __init__(self, slowest):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.time = 0.0
+        self.slowest = []
+        self.keep = slowest
+
+    def add(self, queries, db_time, duration, statements):
+        self.requests += 1
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.db_time += db_time
+        self.time += duration
+        for item in statements:
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'queries_per_request': round(self.queries / self.requests, 2),
+            'max_queries': self.max_queries,
+            'db_ms_per_request': round(self.db_time * 1000 / self.requests, 3),
+            'ms_per_request': round(self.time * 1000 / self.requests, 3),
+            'slowest': [{'ms': round(duration * 1000, 3), 'statement': statement}
+                        for duration, statement in sorted(self.slowest, reverse=True)],
+        }
+
+
+class QueryStats(object):
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, queries, db_time, duration, statements, slowest):
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointStats(slowest)
+            self.endpoints[endpoint].add(queries, db_time, duration, statements)
+
+    def worst(self, by='queries_per_request', limit=20):
+        with self._lock:
+            report = {endpoint: stats.as_dict() for endpoint, stats in self.endpoints.items()}
+        return sorted(report.items(), key=lambda item: item[1][by], reverse=True)[:limit]
+
+    def clear(self):
+        with self._lock:
+            self.endpoints.clear()
+
+
+query_stats = QueryStats()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # after_cursor_execute never runs for a failed statement, so the start
+    # goes on its execution context, which is dropped with it. The few
+    # statements run without one, e.g. sequence defaults, never nest.
+    if context is not None:
+        context._query_start = time.perf_counter()
+    else:
+        conn.info['query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = context._query_start if context is not None else conn.info.pop('query_start')
+    duration = time.perf_counter() - start
+    if has_request_context() and 'query_count' in g:
+        if duration * 1000 >= current_app.config['SLOW_QUERY_MS']:
+            current_app.logger.warning('Slow query (%.1f ms) in %s: %s', duration * 1000, request.endpoint,
+                                       statement[:STATEMENT_LENGTH])
+        g.query_count += 1
+        g.query_time += duration
+        g.statements.append((duration, statement[:STATEMENT_LENGTH]))
+
+
+@bp.before_app_request
+def _start_request_timer():
+    if current_app.config['INSTRUMENTATION']:
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+        g.query_time = 0.0
+        g.statements = []
+
+
+@bp.after_app_request
+def _record_request(response):
+    if 'request_start' not in g:
+        return response
+    duration = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    keep = current_app.config['SLOWEST_QUERIES_KEPT']
+    query_stats.record(endpoint, g.query_count, g.query_time, duration, heapq.nlargest(keep, g.statements), keep)
+    response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+        g.query_time * 1000, g.query_count, duration * 1000)
+    request_logger.info(json.dumps({
+        'endpoint': endpoint, 'method': request.method, 'path': request.path, 'status': response.status_code,
+        'ms': round(duration * 1000, 3), 'queries': g.query_count, 'db_ms': round(g.query_time * 1000, 3)}))
+    return response
+
+
+@bp.route('/debug/queries')
+def debug_queries():
+    # opt in with QUERY_DEBUG_ENDPOINT; ?by= any numeric field, e.g. db_ms_per_request
+    if not current_app.config['QUERY_DEBUG_ENDPOINT']:
+        abort(404)
+    by = request.args.get('by', 'queries_per_request')
+    if by not in ('queries_per_request', 'max_queries', 'db_ms_per_request', 'ms_per_request', 'requests'):
+        abort(400)
+    return jsonify([dict(stats, endpoint=endpoint) for endpoint, stats in query_stats.worst(by)])
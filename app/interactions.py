@@ -0,0 +1,147 @@
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, func, select
+from sqlalchemy.dialects import postgresql
+
+from app import db, timeline
+from app.models import Comment, Event, Post, PostLike, User, UserToEvent, followers
+
+# Batch versions of User.like_post, User.follow, Post.add_comment and event
+# RSVPs for bursts of interactions and imports. Each call de-duplicates its
+# input with one set-based existence query, writes with executemany and bumps
+# the counters in one statement per table. Nothing is committed, so the
+# caller commits the whole batch once.
+
+
+def insert_ignore(table, rows):
+    # rows that hit a unique constraint, e.g. a like that raced in after the
+    # existence check, are skipped instead of failing the batch. Returns how
+    # many rows went in, or None when the driver cannot tell.
+    if not rows:
+        return 0
+    dialect = db.session.get_bind().dialect
+    if dialect.name == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect.name == 'sqlite':
+        statement = table.insert().prefix_with('OR IGNORE')
+    elif dialect.name == 'mysql':
+        statement = table.insert().prefix_with('IGNORE')
+    else:
+        statement = table.insert()
+    result = db.session.execute(statement, rows)
+    sane = dialect.supports_sane_multi_rowcount if len(rows) > 1 else dialect.supports_sane_rowcount
+    return result.rowcount if sane else None
+
+
+def add_counts(column, counts, bump_version=False):
+    if not counts:
+        return
+    table = column.table
+    values = {column.key: column + bindparam('_delta')}
+    if bump_version:
+        values['version'] = table.c.version + 1
+    statement = table.update().where(table.c.id == bindparam('_id')).values(values)
+    db.session.execute(statement, [{'_id': id, '_delta': delta} for id, delta in counts.items()])
+
+
+def _recount(column, foreign_key, ids, bump_version=False):
+    # for batches where insert_ignore skipped rows: which ones is unknown, so
+    # the affected counters are recounted from the source table instead
+    if not ids:
+        return
+    table = column.table
+    values = {column.key: select([func.count()]).where(foreign_key == table.c.id).as_scalar()}
+    if bump_version:
+        values['version'] = table.c.version + 1
+    db.session.execute(table.update().where(table.c.id.in_(ids)).values(values))
+
+
+def like_posts(pairs):
+    # pairs are (user_id, post_id); returns the number of new likes
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    existing = db.session.query(PostLike.user_id, PostLike.post_id).filter(
+        PostLike.user_id.in_({user_id for user_id, _ in pairs}),
+        PostLike.post_id.in_({post_id for _, post_id in pairs}))
+    new = sorted(pairs - set(existing))
+    now = datetime.utcnow()
+    inserted = insert_ignore(PostLike.__table__, [{'user_id': user_id, 'post_id': post_id, 'timestamp': now}
+                                                  for user_id, post_id in new])
+    if inserted == len(new):
+        add_counts(Post.like_count, Counter(post_id for _, post_id in new), bump_version=True)
+        return inserted
+    _recount(Post.like_count, PostLike.post_id, {post_id for _, post_id in new}, bump_version=True)
+    return len(new) if inserted is None else inserted
+
+
+def follow_users(pairs):
+    # pairs are (follower_id, followed_id); self-follows are dropped and the
+    # number of new follows is returned
+    pairs = {(follower_id, followed_id) for follower_id, followed_id in pairs if follower_id != followed_id}
+    if not pairs:
+        return 0
+    existing = db.session.query(followers.c.follower_id, followers.c.followed_id).filter(
+        followers.c.follower_id.in_({follower_id for follower_id, _ in pairs}),
+        followers.c.followed_id.in_({followed_id for _, followed_id in pairs}))
+    new = sorted(pairs - set(existing))
+    inserted = insert_ignore(followers, [{'follower_id': follower_id, 'followed_id': followed_id}
+                                         for follower_id, followed_id in new])
+    if inserted == len(new):
+        add_counts(User.followed_count, Counter(follower_id for follower_id, _ in new))
+        add_counts(User.follower_count, Counter(followed_id for _, followed_id in new))
+    else:
+        _recount(User.followed_count, followers.c.follower_id, {follower_id for follower_id, _ in new})
+        _recount(User.follower_count, followers.c.followed_id, {followed_id for _, followed_id in new})
+    timeline.add_follows(new)
+    return len(new) if inserted is None else inserted
+
+
+def add_comments(comments):
+    # comments are (post_id, user_id, body) triples
+    comments = list(comments)
+    now = datetime.utcnow()
+    if comments:
+        db.session.execute(Comment.__table__.insert(), [
+            {'post_id': post_id, 'user_id': user_id, 'body': body, 'timestamp': now}
+            for post_id, user_id, body in comments])
+    add_counts(Post.comment_count, Counter(post_id for post_id, _, _ in comments), bump_version=True)
+    return len(comments)
+
+
+def rsvp_events(pairs):
+    # pairs are (user_id, event_id); returns the number of new RSVPs
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    existing = db.session.query(UserToEvent.user_id, UserToEvent.event_id).filter(
+        UserToEvent.user_id.in_({user_id for user_id, _ in pairs}),
+        UserToEvent.event_id.in_({event_id for _, event_id in pairs}))
+    new = sorted(pairs - set(existing))
+    inserted = insert_ignore(UserToEvent.__table__, [{'user_id': user_id, 'event_id': event_id}
+                                                     for user_id, event_id in new])
+    if inserted == len(new):
+        add_counts(Event.attendee_count, Counter(event_id for _, event_id in new))
+        return inserted
+    _recount(Event.attendee_count, UserToEvent.event_id, {event_id for _, event_id in new})
+    return len(new) if inserted is None else inserted
+
+
+def cancel_rsvps(pairs):
+    # pairs are (user_id, event_id); returns the number of RSVPs removed
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    existing = set(db.session.query(UserToEvent.user_id, UserToEvent.event_id).filter(
+        UserToEvent.user_id.in_({user_id for user_id, _ in pairs}),
+        UserToEvent.event_id.in_({event_id for _, event_id in pairs}))) & pairs
+    if existing:
+        table = UserToEvent.__table__
+        statement = table.delete().where(and_(table.c.user_id == bindparam('_user_id'),
+                                              table.c.event_id == bindparam('_event_id')))
+        db.session.execute(statement, [{'_user_id': user_id, '_event_id': event_id}
+                                       for user_id, event_id in existing])
+    removed = Counter(event_id for _, event_id in existing)
+    add_counts(Event.attendee_count, {event_id: -count for event_id, count in removed.items()})
+    return len(existing)
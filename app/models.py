@@ -1,55 +1,138 @@
-from app import db, login
+from app import db, login, passwords, user_cache
+import re
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy.orm import joinedload, make_transient_to_detached, validates
+from sqlalchemy.orm.attributes import set_committed_value
 
-followers = db.Table('followers', db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-                     db.Column('followed_id', db.Integer, db.ForeignKey('user.id')))
+
+def increment(obj, column, delta=1, bump_version=False):
+    # counters are bumped with an UPDATE ... SET col = col + n so concurrent
+    # writers never lose an increment; bump_version also moves the object's
+    # version on, which invalidates its cached fragments
+    values = {column: column + delta}
+    if bump_version:
+        values[type(obj).version] = type(obj).version + 1
+    type(obj).query.filter_by(id=obj.id).update(values, synchronize_session=False)
+    db.session.expire(obj, [c.key for c in values])
+
+
+followers = db.Table('followers', db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                     db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+                     db.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id'))
 
 
 class User(UserMixin, db.Model):
+    __searchable__ = ['username', 'first_name', 'last_name']
     id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), index=True, unique=True)
     first_name = db.Column(db.String(120))
     last_name = db.Column(db.String(120))
     email = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(128))
     dob = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
+    comments = db.relationship('Comment', backref='author', lazy='dynamic')
     liked = db.relationship('PostLike', foreign_keys='PostLike.user_id', backref='user', lazy='dynamic')
     user_details = db.Column(db.String(150))
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # written by app.notifications in batches, recounted from what is newer
+    # than notifications_read_at when the user opens their notifications
+    unread_notification_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # notifications up to this timestamp have been shown to the user
+    notifications_read_at = db.Column(db.DateTime)
+    # set on insert and whenever a __searchable__ field changes, see app.search
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     events = db.relationship('UserToEvent', back_populates='user', lazy=True)
     followed = db.relationship('User', secondary=followers, primaryjoin=(followers.c.follower_id == id),
                                secondaryjoin=(followers.c.followed_id == id),
                                backref=db.backref('followers', lazy='dynamic'), lazy='dynamic')
 
+    # columns kept in the session cache; counters change too often and are
+    # loaded from the database when a page actually shows them
+    cached_columns = ('id', 'username', 'first_name', 'last_name', 'email', 'password_hash', 'dob', 'user_details')
+    # columns rendered into cached post fragments; changing one calls touch_posts
+    fragment_columns = ('username', 'first_name', 'last_name')
+
     def __repr__(self):
         return '<User {}>'.format(self.email)
 
+    @validates('username')
+    def validate_username(self, key, username):
+        # usernames are stored lower case so profile lookups are a plain
+        # equality match on the unique index
+        return username.lower() if username else username
+
+    @staticmethod
+    def username_base(first_name, last_name):
+        base = re.sub(r'[^a-z0-9]+', '.', ' '.join(filter(None, [first_name, last_name])).lower()).strip('.')[:60]
+        return base or 'user'
+
+    @staticmethod
+    def first_free_username(base, taken):
+        username, suffix = base, 1
+        while username in taken:
+            suffix += 1
+            username = '{}{}'.format(base, suffix)
+        return username
+
+    @staticmethod
+    def make_unique_username(first_name, last_name, taken=()):
+        base = User.username_base(first_name, last_name)
+        # usernames only contain [a-z0-9.], all of which sort before '~'
+        taken = set(taken)
+        taken.update(name for name, in db.session.query(User.username).filter(
+            User.username.between(base, base + '~')))
+        return User.first_free_username(base, taken)
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # a correct password stored with outdated hash parameters is hashed
+        # again with the current ones; the caller commits
+        if not passwords.check_password(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def like_post(self, post):
         if not self.has_liked_post(post):
             like = PostLike(user_id=self.id, post_id=post.id)
             db.session.add(like)
+            increment(post, Post.like_count, bump_version=True)
+            return like
 
     def unlike_post(self, post):
-        if self.has_liked_post(post):
-            PostLike.query.filter_by(user_id=self.id, post_id=post.id).delete()
+        deleted = PostLike.query.filter_by(user_id=self.id, post_id=post.id).delete()
+        if deleted:
+            increment(post, Post.like_count, -deleted, bump_version=True)
 
     def has_liked_post(self, post):
         return PostLike.query.filter(PostLike.user_id == self.id, PostLike.post_id == post.id).count() > 0
 
     def follow(self, user):
         if not self.is_following(user):
-            self.followed.remove(user)
+            self.followed.append(user)
+            increment(self, User.followed_count)
+            increment(user, User.follower_count)
+            return True
+        return False
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            increment(self, User.followed_count, -1)
+            increment(user, User.follower_count, -1)
+
+    def touch_posts(self):
+        # the author's name and link are part of every cached post fragment,
+        # and of the fragments of posts they commented on
+        commented = db.session.query(Comment.post_id).filter(Comment.user_id == self.id)
+        Post.query.filter(db.or_(Post.user_id == self.id, Post.id.in_(commented))).update(
+            {Post.version: Post.version + 1}, synchronize_session=False)
 
     def is_following(self, user):
         return self.followed.filter(followers.c.followed_id == user.id).count() > 0
@@ -60,28 +143,120 @@ class User(UserMixin, db.Model):
         own = Post.query.filter_by(user_id=self.id)
         return followed.union(own).order_by(Post.timestamp.desc())
 
+    def calendar(self, since=None):
+        # the user's events in one joined query instead of a lazy load per
+        # UserToEvent row
+        query = Event.query.join(UserToEvent, UserToEvent.event_id == Event.id).filter(UserToEvent.user_id == self.id)
+        if since is not None:
+            query = query.filter(Event.start_time_date >= since)
+        return query.order_by(Event.start_time_date, Event.id)
+
 
 class Post(db.Model):
+    __searchable__ = ['post_details']
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     post_details = db.Column(db.String(150))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    like_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # bumped whenever the rendered post changes, see routes.feed_page
+    version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     likes = db.relationship('PostLike', backref='post', lazy='dynamic')
     comments = db.relationship('Comment', backref='title', lazy='dynamic')
     # favorites = db.Column(db.Integer)
+    __table_args__ = (db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),)
+
+    def add_comment(self, body, author=None):
+        comment = Comment(body=body, post_id=self.id, author=author)
+        db.session.add(comment)
+        increment(self, Post.comment_count, bump_version=True)
+        return comment
 
     def get_comments(self):
-        return Comment.query.filter_by(post_id=post.id).order_by(Comment.timestamp.desc())
+        # newest first, along ix_comment_post_id_timestamp
+        return self.comments.order_by(Comment.timestamp.desc(), Comment.id.desc())
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
 
 
+class PostStats(object):
+    def __init__(self):
+        self.liked = False
+        self.comments = []
+
+
+def hydrate_posts(posts, viewer, comments_per_post, detail_ids=None):
+    # Loads everything _post.html needs for a whole page of posts in a fixed
+    # number of grouped queries, instead of several queries per post. Authors
+    # and comments are only loaded for posts in detail_ids, when given.
+    posts = list(posts)
+    ids = [post.id for post in posts]
+    stats = {post_id: PostStats() for post_id in ids}
+    for post in posts:
+        post.stats = stats[post.id]
+    if not ids:
+        return posts
+    detail_ids = set(ids if detail_ids is None else detail_ids)
+
+    detailed = [post for post in posts if post.id in detail_ids]
+    if detailed:
+        authors = {user.id: user for user in User.query.filter(User.id.in_({post.user_id for post in detailed}))}
+        for post in detailed:
+            if post.user_id in authors:
+                set_committed_value(post, 'author', authors[post.user_id])
+
+    if viewer.is_authenticated:
+        liked = db.session.query(PostLike.post_id).filter(PostLike.user_id == viewer.id, PostLike.post_id.in_(ids))
+        for post_id, in liked:
+            stats[post_id].liked = True
+
+    if not detailed:
+        return posts
+    ranked = db.session.query(Comment.id.label('id'), db.func.row_number().over(
+        partition_by=Comment.post_id, order_by=(Comment.timestamp.desc(), Comment.id.desc())).label('rank')).filter(
+        Comment.post_id.in_(detail_ids)).subquery()
+    recent = Comment.query.join(ranked, ranked.c.id == Comment.id).filter(ranked.c.rank <= comments_per_post).order_by(
+        Comment.timestamp.desc(), Comment.id.desc()).options(joinedload(Comment.author))
+    for comment in recent:
+        stats[comment.post_id].comments.append(comment)
+    return posts
+
+
+def reconcile_counters():
+    # Recounts every denormalized counter from its source table in one UPDATE
+    # per counter and returns how many rows had drifted.
+    counters = [
+        (Post, Post.like_count, db.select([db.func.count(PostLike.id)]).where(PostLike.post_id == Post.id)),
+        (Post, Post.comment_count, db.select([db.func.count(Comment.id)]).where(Comment.post_id == Post.id)),
+        (User, User.follower_count, db.select([db.func.count()]).where(followers.c.followed_id == User.id)),
+        (User, User.followed_count, db.select([db.func.count()]).where(followers.c.follower_id == User.id)),
+        (Event, Event.attendee_count,
+         db.select([db.func.count()]).where(UserToEvent.event_id == Event.id)),
+        (User, User.unread_notification_count, db.select([db.func.count(Notification.id)]).where(
+            Notification.recipient_id == User.id).where(db.or_(User.notifications_read_at.is_(None),
+                                                               Notification.timestamp > User.notifications_read_at))),
+    ]
+    fixed = {}
+    for model, column, actual in counters:
+        actual = actual.as_scalar()
+        fixed['{}.{}'.format(model.__tablename__, column.key)] = model.query.filter(column != actual).update(
+            {column: actual}, synchronize_session=False)
+    return fixed
+
+
 class Comment(db.Model):
+    __searchable__ = ['body']
     id = db.Column(db.Integer, primary_key=True )
     body = db.Column(db.String(100))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # a post's thread is read newest first, a page at a time
+    __table_args__ = (db.Index('ix_comment_post_id_timestamp', 'post_id', 'timestamp'),)
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
@@ -90,24 +265,51 @@ class Comment(db.Model):
 class PostLike(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_post_like_user_id_post_id', 'user_id', 'post_id', unique=True),)
 
     def __repr__(self):
         return '<PostLike {}>'.format(self.body)
 
 
+def location_key(location):
+    # "Brooklyn, NY" and "brooklyn ny" share the key "brooklyn ny"
+    return re.sub(r'[^a-z0-9]+', ' ', location.lower()).strip() if location else None
+
+
 class Event(db.Model):
+    __searchable__ = ['title', 'location']
     id = db.Column(db.Integer, primary_key=True)
     location = db.Column(db.String)
+    location_key = db.Column(db.String(120))
     title = db.Column(db.String(64))
     start_time_date = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     organizer = db.Column(db.Integer, db.ForeignKey('user.id'))
+    attendee_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     attendees = db.relationship("UserToEvent", back_populates='event', lazy=True)
+    __table_args__ = (db.Index('ix_event_location_key_start_time_date', 'location_key', 'start_time_date'),)
 
     def __repr__(self):
         return '<Event {}>'.format(self.title)
 
+    @validates('location')
+    def validate_location(self, key, location):
+        self.location_key = location_key(location)
+        return location
+
+    @staticmethod
+    def upcoming(location=None, now=None):
+        # a range scan on start_time_date, or on (location_key, start_time_date)
+        # when a place is given; a place matches every key it is a prefix of
+        query = Event.query.filter(Event.start_time_date >= (now or datetime.utcnow()))
+        key = location_key(location)
+        if key:
+            # keys only contain [a-z0-9 ], all of which sort before '~'
+            query = query.filter(Event.location_key.between(key, key + '~'))
+        return query
+
 
 # class Friends(db.Model):
 #     id = db.Column(db.Integer, primary_key=True, nullable=False)
@@ -124,17 +326,81 @@ class Notification(db.Model):
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     type = db.Column(db.String(64))
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    sender = db.relationship('User', foreign_keys=[sender_id])
+    post = db.relationship('Post')
+    __table_args__ = (db.Index('ix_notification_recipient_id_timestamp', 'recipient_id', 'timestamp'),)
 
     def __repr__(self):
         return '<Notifications {}>'.format(self.id)
 
 
+class NotificationOutbox(db.Model):
+    # notifications committed with the request that caused them and not yet
+    # moved into Notification by app.notifications
+    id = db.Column(db.Integer, primary_key=True)
+    recipient_id = db.Column(db.Integer)
+    sender_id = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime)
+    type = db.Column(db.String(64))
+    post_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return '<NotificationOutbox {}>'.format(self.id)
+
+
+class SearchTombstone(db.Model):
+    # a deleted searchable row, so every worker's search index drops it too
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16))
+    doc_id = db.Column(db.Integer)
+    deleted_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<SearchTombstone {} {}>'.format(self.kind, self.doc_id)
+
+
+class TimelineEntry(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_timeline_entry_user_id_timestamp', 'user_id', 'timestamp'),)
+
+    def __repr__(self):
+        return '<TimelineEntry {} {}>'.format(self.user_id, self.post_id)
+
+
+class PhotoBlob(db.Model):
+    # one row per distinct image content, stored on disk under its sha256
+    hash = db.Column(db.String(64), primary_key=True)
+    extension = db.Column(db.String(8))
+    size = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    photos = db.relationship('Photo', backref='blob', lazy='dynamic')
+
+    def __repr__(self):
+        return '<PhotoBlob {}>'.format(self.hash)
+
+
+class Photo(db.Model):
+    # an upload by a user; many photos can share the same blob
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    blob_hash = db.Column(db.String(64), db.ForeignKey('photo_blob.hash'), index=True)
+    filename = db.Column(db.String(255))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<Photo {}>'.format(self.id)
+
+
 class UserToEvent(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'), primary_key=True)
     extra_data = db.Column(db.String(50))
     event = db.relationship("Event", back_populates="attendees")
     user = db.relationship("User", back_populates="events")
+    __table_args__ = (db.Index('ix_user_to_event_event_id', 'event_id'),)
 
     def __repr__(self):
         return '<UserToEvent {}>'.format(self.id)
@@ -142,4 +408,52 @@ class UserToEvent(db.Model):
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    data = user_cache.get(int(id))
+    if data is None:
+        user = User.query.get(int(id))
+        if user is not None:
+            user_cache.set(user.id, {column: getattr(user, column) for column in User.cached_columns})
+        return user
+    # rebuild the user from the cached columns and attach it to the session
+    # without a SELECT
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_user_ids', set())
+    changed.update(obj.id for obj in session.dirty | session.deleted if isinstance(obj, User))
+
+
+def _invalidate_changed_users(session):
+    for id in session.info.pop('changed_user_ids', ()):
+        user_cache.delete(id)
+
+
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
+
+
+def _assign_usernames(session, flush_context, instances):
+    # every new user gets a unique username derived from their name
+    assigned = set()
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, User) and not obj.username:
+                obj.username = User.make_unique_username(obj.first_name, obj.last_name, assigned)
+                assigned.add(obj.username)
+
+
+def _touch_renamed_users(session, flush_context, instances):
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(db.inspect(obj).attrs[column].history.has_changes()
+                                         for column in User.fragment_columns):
+            obj.touch_posts()
+
+
+db.event.listen(db.session, 'before_flush', _assign_usernames)
+db.event.listen(db.session, 'before_flush', _touch_renamed_users)
+db.event.listen(db.session, 'after_flush', _collect_changed_users)
+db.event.listen(db.session, 'after_commit', _invalidate_changed_users)
+db.event.listen(db.session, 'after_rollback', _forget_changed_users)
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+
+from app import db, per_app, unread_cache
+from app.interactions import add_counts
+from app.models import Notification, NotificationOutbox, User
+
+FOLLOWING = 'following'
+LIKED = 'like post'
+COMMENTED = 'commented'
+
+
+class NotificationQueue(object):
+    # Notifications are never written to Notification inside the request that
+    # caused them. notify() stages them on the session and they are appended
+    # to notification_outbox in the same transaction with one executemany, so
+    # a restart or crash loses nothing. A writer thread moves outbox rows into
+    # Notification in batches: one executemany plus one counter UPDATE per
+    # batch, deleting the moved rows in the same transaction. Unread counts
+    # are read from User.unread_notification_count through unread_cache,
+    # never by COUNT.
+
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def put(self):
+        # called once a transaction that added outbox rows has committed
+        if current_app.config['NOTIFICATION_BACKGROUND_DELIVERY']:
+            self._start(current_app._get_current_object())
+            self.wakeup.set()
+
+    def flush(self):
+        # moves everything in the outbox from the calling thread
+        moved = 0
+        while True:
+            count = self.deliver(current_app.config['NOTIFICATION_BATCH_SIZE'])
+            if not count:
+                return moved
+            moved += count
+
+    def deliver(self, limit):
+        # Moves up to limit of the oldest outbox rows and commits. Writers in
+        # other processes may read the same rows, so the DELETE is the claim:
+        # when it removes fewer rows than were read, another writer got there
+        # first and this batch is rolled back.
+        outbox = NotificationOutbox.__table__
+        rows = [dict(row) for row in db.session.execute(outbox.select().order_by(outbox.c.id).limit(limit))]
+        if not rows:
+            return 0
+        ids = [row.pop('id') for row in rows]
+        if db.session.execute(outbox.delete().where(outbox.c.id.in_(ids))).rowcount != len(ids):
+            db.session.rollback()
+            return 0
+        db.session.execute(Notification.__table__.insert(), rows)
+        counts = Counter(row['recipient_id'] for row in rows)
+        add_counts(User.unread_notification_count, counts)
+        db.session.commit()
+        for user_id in counts:
+            unread_cache.delete(user_id)
+        return len(rows)
+
+    def unread_count(self, user_id):
+        if current_app.config['NOTIFICATION_BACKGROUND_DELIVERY']:
+            # also picks up rows a previous process left in the outbox
+            self._start(current_app._get_current_object())
+        else:
+            self.flush()
+        count = unread_cache.get(user_id)
+        if count is None:
+            count = db.session.query(User.unread_notification_count).filter_by(id=user_id).scalar() or 0
+            unread_cache.set(user_id, count)
+        return count
+
+    def mark_read(self, user_id, up_to):
+        # only notifications up to the newest one shown count as read; the
+        # rest, e.g. delivered while the page was built, stay unread
+        unread = db.select([db.func.count(Notification.id)]).where(Notification.recipient_id == user_id).where(
+            Notification.timestamp > up_to).as_scalar()
+        User.query.filter(User.id == user_id, db.or_(User.notifications_read_at.is_(None),
+                                                     User.notifications_read_at < up_to)).update(
+            {User.notifications_read_at: up_to, User.unread_notification_count: unread}, synchronize_session=False)
+        unread_cache.delete(user_id)
+
+    def _start(self, app):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,), name='notification-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        while True:
+            # woken by a local commit, or polling for rows other processes
+            # left behind; the short sleep lets a batch build up
+            self.wakeup.wait(app.config['NOTIFICATION_POLL_INTERVAL'])
+            time.sleep(app.config['NOTIFICATION_FLUSH_INTERVAL'])
+            self.wakeup.clear()
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Delivering notifications failed')
+                finally:
+                    db.session.remove()
+
+
+notification_queue = per_app('notification_queue')
+
+
+def notify(recipient_id, sender_id, type, post_id=None):
+    # staged on the session, so a rolled back request notifies nobody
+    if recipient_id is None or recipient_id == sender_id:
+        return
+    db.session.info.setdefault('pending_notifications', []).append({
+        'recipient_id': recipient_id, 'sender_id': sender_id, 'type': type, 'post_id': post_id,
+        'timestamp': datetime.utcnow()})
+
+
+def _write_outbox(session):
+    rows = session.info.pop('pending_notifications', None)
+    if rows:
+        session.execute(NotificationOutbox.__table__.insert(), rows)
+        session.info['outbox_written'] = True
+
+
+def _wake_writer(session):
+    if session.info.pop('outbox_written', False):
+        notification_queue.put()
+
+
+def _forget_notifications(session):
+    session.info.pop('pending_notifications', None)
+    session.info.pop('outbox_written', None)
+
+
+db.event.listen(db.session, 'before_commit', _write_outbox)
+db.event.listen(db.session, 'after_commit', _wake_writer)
+db.event.listen(db.session, 'after_rollback', _forget_notifications)
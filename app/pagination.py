@@ -0,0 +1,133 @@
+import base64
+import binascii
+import operator
+from datetime import datetime
+
+from sqlalchemy import and_, asc, desc, or_
+
+from app.models import Post
+
+
+class KeysetPage(object):
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(timestamp, id):
+    raw = '{}|{}'.format(timestamp.isoformat(), id).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # a malformed cursor is treated like no cursor at all, i.e. the first page
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, id = raw.rsplit('|', 1)
+        return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp
+                                 else '%Y-%m-%dT%H:%M:%S'), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def paginate_keyset(query, per_page, after=None, before=None, columns=(Post.timestamp, Post.id),
+                    key=lambda item: (item.timestamp, item.id), oldest_first=False):
+    # Newest-first pagination on (timestamp, id), or oldest-first for lists
+    # like upcoming events. Every page is a range scan starting at the
+    # cursor, so deep pages cost the same as the first one and no total count
+    # is needed.
+    timestamp, id = columns
+    if oldest_first:
+        ahead, behind, forward, backward = operator.gt, operator.lt, asc, desc
+    else:
+        ahead, behind, forward, backward = operator.lt, operator.gt, desc, asc
+    query = query.order_by(None)
+    before = decode_cursor(before)
+    after = decode_cursor(after)
+    if before is not None:
+        rows = query.filter(or_(behind(timestamp, before[0]), and_(timestamp == before[0], behind(id, before[1])))) \
+            .order_by(backward(timestamp), backward(id)).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_prev, has_next = more, True
+    else:
+        rows = _after(query, columns, after, ahead).order_by(forward(timestamp), forward(id)).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev, has_next = after is not None, len(rows) > per_page
+    if not items:
+        return KeysetPage(items)
+    return KeysetPage(items, encode_cursor(*key(items[-1])) if has_next else None,
+                      encode_cursor(*key(items[0])) if has_prev else None)
+
+
+def _after(query, columns, after, ahead=operator.lt):
+    if after is None:
+        return query
+    timestamp, id = columns
+    return query.filter(or_(ahead(timestamp, after[0]), and_(timestamp == after[0], ahead(id, after[1]))))
+
+
+class KeysetStream(KeysetPage):
+    # A newest-first keyset page read through a server-side cursor, chunk rows
+    # at a time: iterating yields the items as the rows arrive, and the
+    # cursors are set once the whole page has been read. Used for streamed
+    # pages, which only go forward, i.e. never take a before cursor.
+
+    def __init__(self, query, per_page, after=None, columns=(Post.timestamp, Post.id),
+                 key=lambda item: (item.timestamp, item.id), chunk=10):
+        KeysetPage.__init__(self, None)
+        self.after = decode_cursor(after)
+        timestamp, id = columns
+        self.query = _after(query.order_by(None), columns, self.after).order_by(timestamp.desc(), id.desc()) \
+            .limit(per_page + 1).yield_per(chunk)
+        self.per_page = per_page
+        self.key = key
+
+    def __iter__(self):
+        first = last = None
+        count = 0
+        for item in self.query:
+            count += 1
+            if count > self.per_page:
+                break
+            first = item if first is None else first
+            last = item
+            yield item
+        if first is None:
+            return
+        self.next_cursor = encode_cursor(*self.key(last)) if count > self.per_page else None
+        self.prev_cursor = encode_cursor(*self.key(first)) if self.after is not None else None
+
+
+def paginate_by_id(query, column, per_page, after=None, before=None, key=lambda item: item.id):
+    # Keyset pagination on a single integer column, lowest first, for lists
+    # without a timestamp such as a user's followers. The cursors are the
+    # plain ids; anything else is treated like no cursor.
+    after = int(after) if after and str(after).isdigit() else None
+    before = int(before) if before and str(before).isdigit() else None
+    query = query.order_by(None)
+    if before is not None:
+        rows = query.filter(column < before).order_by(column.desc()).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_prev, has_next = more, True
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        rows = query.order_by(column.asc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev, has_next = after is not None, len(rows) > per_page
+    if not items:
+        return KeysetPage(items)
+    return KeysetPage(items, str(key(items[-1])) if has_next else None, str(key(items[0])) if has_prev else None)
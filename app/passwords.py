@@ -0,0 +1,98 @@
+import threading
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = 0
+
+
+class HasherBusy(Exception):
+    # more hashing work is queued than PASSWORD_QUEUE_LIMIT allows; the
+    # request fails fast with a 503 instead of waiting behind it
+    pass
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=current_app.config['PASSWORD_WORKERS'])
+        return _pool
+
+
+def _reset_pool(pool):
+    # a worker died, e.g. killed for memory, and the executor refuses all
+    # further work; the next call starts a new one
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _done(future):
+    global _pending
+    with _pool_lock:
+        _pending -= 1
+
+
+def _run(function, *args):
+    # PBKDF2 is CPU bound and holds the GIL, so it runs in worker processes
+    # and never in the request thread, unless PASSWORD_WORKERS is 0
+    global _pending
+    config = current_app.config
+    if not config['PASSWORD_WORKERS']:
+        return function(*args)
+    pool = get_pool()
+    with _pool_lock:
+        if _pending >= config['PASSWORD_QUEUE_LIMIT']:
+            raise HasherBusy()
+        _pending += 1
+    try:
+        future = pool.submit(function, *args)
+    except Exception as e:
+        # nothing was queued, so give the slot back
+        _done(None)
+        if isinstance(e, BrokenProcessPool):
+            _reset_pool(pool)
+            raise HasherBusy()
+        raise
+    future.add_done_callback(_done)
+    try:
+        return future.result(timeout=config['PASSWORD_TIMEOUT'])
+    except TimeoutError:
+        raise HasherBusy()
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise HasherBusy()
+
+
+def hasher():
+    # generate_password_hash with the configured parameters, picklable for
+    # callers that hash in bulk in their own pool
+    config = current_app.config
+    return partial(generate_password_hash, method=config['PASSWORD_HASH_METHOD'],
+                   salt_length=config['PASSWORD_SALT_LENGTH'])
+
+
+def hash_password(password):
+    return _run(hasher(), password)
+
+
+def check_password(password_hash, password):
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    # werkzeug hashes look like method$salt$hash, e.g. pbkdf2:sha256:150000$...
+    method, _, rest = password_hash.partition('$')
+    salt = rest.partition('$')[0]
+    config = current_app.config
+    return method != config['PASSWORD_HASH_METHOD'] or len(salt) != config['PASSWORD_SALT_LENGTH']
@@ -1,99 +1,280 @@
-import os
 from datetime import datetime
 
-# from app.main import bp
-from flask import render_template, flash, redirect, url_for, request, session, current_app
+from flask import render_template, flash, redirect, url_for, request, session, current_app, send_file, abort, \
+    Blueprint, Response, stream_with_context
+from jinja2 import Markup
 from flask_login import login_user, logout_user, current_user, login_required
 from werkzeug.urls import url_parse
-from werkzeug.utils import secure_filename
-
-from app import app, db
-from app.forms import LoginForm, RegistrationForm, EditProfileForm, PostForm, CommentForm
-from app.models import User, Event, UserToEvent, Post, Comment, PostLike
-
-app.config["IMAGE_UPLOADS"] = "/mnt/c/wsl/projects/pythonise/tutorials/flask_series/app/app/static/img/uploads"
-app.config["ALLOWED_IMAGE_EXTENSIONS"] = ["JPEG", "JPG", "PNG", "GIF"]
-app.config["MAX_IMAGE_FILESIZE"] = 0.5 * 1024 * 1024
-
-
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/index', methods=['GET', 'POST'])
+from sqlalchemy.orm import joinedload
+
+from app import db, timeline, images, interactions, fragment_cache
+from app.forms import LoginForm, RegistrationForm, EditProfileForm, PostForm, CommentForm, EventForm
+from app.models import User, Event, UserToEvent, Post, Comment, Notification, hydrate_posts, followers
+from app.explore import explore_feed
+from app.notifications import notification_queue, notify, FOLLOWING, LIKED, COMMENTED
+from app.pagination import paginate_keyset, paginate_by_id, KeysetStream
+from app.search import search_index
+from app.storage import photo_store
+from app.suggestions import suggested_users
+
+bp = Blueprint('main', __name__)
+
+
+def feed_page(posts):
+    # The viewer-independent body of each post is rendered once per post
+    # version and cached; only the like toggle is rendered per viewer.
+    posts = list(posts)
+    fragments = {post.id: fragment_cache.get(('post', post.id, post.version)) for post in posts}
+    missing = [post_id for post_id, fragment in fragments.items() if fragment is None]
+    hydrate_posts(posts, current_user, current_app.config['COMMENTS_PER_POST'], detail_ids=missing)
+    for post in posts:
+        if fragments[post.id] is None:
+            fragments[post.id] = Markup(render_template('_post_body.html', post=post))
+            fragment_cache.set(('post', post.id, post.version), fragments[post.id])
+        post.fragment = fragments[post.id]
+    return posts
+
+
+def paginate_feed(query, endpoint, columns=(Post.timestamp, Post.id), **kwargs):
+    if current_app.config['FEED_PAGINATION'] == 'cursor':
+        posts = paginate_keyset(query, current_app.config['POSTS_PER_PAGE'], after=request.args.get('after'),
+                                before=request.args.get('before'), columns=columns)
+        next_url = url_for(endpoint, after=posts.next_cursor, **kwargs) \
+            if posts.has_next else None
+        prev_url = url_for(endpoint, before=posts.prev_cursor, **kwargs) \
+            if posts.has_prev else None
+    else:
+        page = request.args.get('page', 1, type=int)
+        posts = query.paginate(page, current_app.config['POSTS_PER_PAGE'], False)
+        next_url = url_for(endpoint, page=posts.next_num, **kwargs) \
+            if posts.has_next else None
+        prev_url = url_for(endpoint, page=posts.prev_num, **kwargs) \
+            if posts.has_prev else None
+    return feed_page(posts.items), next_url, prev_url
+
+
+class Deferred(object):
+    # a template value computed when the template gets to it, for pager links
+    # below a streamed list of posts
+    def __init__(self, compute):
+        self.compute = compute
+
+    def __bool__(self):
+        return bool(self.compute())
+
+    def __str__(self):
+        return str(self.compute())
+
+
+def streaming():
+    # only forward cursor pages are streamed, "newer posts" pages read their
+    # rows in reverse and are rendered as a whole
+    return current_app.config['FEED_STREAMING'] and current_app.config['FEED_PAGINATION'] == 'cursor' \
+        and not request.args.get('before')
+
+
+def stream_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_feed(query, endpoint, columns=(Post.timestamp, Post.id), **kwargs):
+    # Streamed counterpart of paginate_feed: rows come from a server-side
+    # cursor and are hydrated and rendered FEED_STREAM_CHUNK at a time.
+    size = current_app.config['FEED_STREAM_CHUNK']
+    page = KeysetStream(query, current_app.config['POSTS_PER_PAGE'], after=request.args.get('after'), columns=columns,
+                        chunk=size)
+    posts = (post for chunk in stream_chunks(page, size) for post in feed_page(chunk))
+    next_url = Deferred(lambda: url_for(endpoint, after=page.next_cursor, **kwargs) if page.has_next else None)
+    prev_url = Deferred(lambda: url_for(endpoint, before=page.prev_cursor, **kwargs) if page.has_prev else None)
+    return posts, next_url, prev_url
+
+
+def stream_template(template_name, **context):
+    # The page goes out as the template reaches each part of it: the layout
+    # and post form first, then the posts as their rows are read. Only used
+    # for read-only pages, so the whole render reads from the replica.
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+
+    def generate():
+        with db.replica():
+            stream = template.stream(context)
+            stream.enable_buffering(current_app.config['FEED_STREAM_BUFFER'])
+            for part in stream:
+                yield part
+
+    return Response(stream_with_context(generate()))
+
+
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
 @login_required
 def index():
     form = PostForm()
     if form.validate_on_submit():
         post = Post(author=current_user, post_details=form.content.data)
         db.session.add(post)
+        timeline.fan_out_post(post)
         db.session.commit()
-        return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    posts = current_user.followed_posts().paginate(page, app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('index', page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for('index', page=posts.prev_num) \
-        if posts.has_prev else None
-    return render_template('index.html', title='Home', posts=posts.items, form=form,
+        return redirect(url_for('main.index'))
+    with db.replica():
+        suggestions = suggested_users(current_user, current_app.config['SUGGESTIONS_SHOWN'])
+        if streaming():
+            posts, next_url, prev_url = stream_feed(timeline.home_posts(current_user), 'main.index',
+                                                    timeline.home_keys())
+            return stream_template('index.html', title='Home', posts=posts, form=form, suggestions=suggestions,
+                                   next_url=next_url, prev_url=prev_url)
+        posts, next_url, prev_url = paginate_feed(timeline.home_posts(current_user), 'main.index',
+                                                  timeline.home_keys())
+        return render_template('index.html', title='Home', posts=posts, form=form, suggestions=suggestions,
+                               next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/explore')
+@login_required
+@db.replica()
+def explore():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['POSTS_PER_PAGE']
+    ranked = explore_feed.ranked_ids()
+    ids = ranked[(page - 1) * per_page:page * per_page]
+    next_url = url_for('main.explore', page=page + 1) \
+        if page * per_page < len(ranked) else None
+    prev_url = url_for('main.explore', page=page - 1) \
+        if page > 1 else None
+    if streaming():
+        posts = (post for chunk in stream_chunks(ids, current_app.config['FEED_STREAM_CHUNK'])
+                 for post in feed_page(ranked_posts(chunk)))
+        return stream_template('index.html', title='Explore', posts=posts,
+                               next_url=next_url, prev_url=prev_url)
+    return render_template('index.html', title='Explore', posts=feed_page(ranked_posts(ids)),
                            next_url=next_url, prev_url=prev_url)
 
 
-@app.route('/explore')
+def ranked_posts(ids):
+    by_id = {post.id: post for post in Post.query.filter(Post.id.in_(ids))} if ids else {}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+@bp.route('/search')
 @login_required
-def explore():
-    page = request.args.get('p[age', 1, type=int)
-    posts = Post.query.order_by(Post.timestamp.desc()).paginate(page, app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('index', page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for('index', page=posts.prev_num) \
-        if posts.has_prev else None
-    return render_template('index.html', title='Explore', posts=posts.items,
+def search():
+    q = request.args.get('q', '').strip()
+    results = search_index.search(q, current_app.config['SEARCH_RESULTS']) if q else {}
+    return render_template('search.html', title='Search', q=q, posts=feed_page(results.get('post', [])),
+                           users=results.get('user', []), events=results.get('event', []),
+                           comments=results.get('comment', []))
+
+
+@bp.route('/notifications')
+@login_required
+def notifications():
+    # with inline delivery this also moves the outbox into the page's table
+    unread = notification_queue.unread_count(current_user.id)
+    query = Notification.query.filter_by(recipient_id=current_user.id).options(
+        joinedload(Notification.sender), joinedload(Notification.post))
+    page = paginate_keyset(query, current_app.config['NOTIFICATIONS_PER_PAGE'], after=request.args.get('after'),
+                           before=request.args.get('before'), columns=(Notification.timestamp, Notification.id))
+    if unread and page.items:
+        notification_queue.mark_read(current_user.id, max(item.timestamp for item in page.items))
+        db.session.commit()
+    next_url = url_for('main.notifications', after=page.next_cursor) if page.has_next else None
+    prev_url = url_for('main.notifications', before=page.prev_cursor) if page.has_prev else None
+    return render_template('notifications.html', title='Notifications', notifications=page.items,
                            next_url=next_url, prev_url=prev_url)
 
 
-@app.route('/follow/<first_name>')
+@bp.app_template_global()
+def unread_notifications():
+    return notification_queue.unread_count(current_user.id)
+
+
+@bp.route('/follow/<username>')
 @login_required
-def follow(first_name):
-    user = User.query.filter_by(first_name=first_name).first()
+def follow(username):
+    user = User.query.filter_by(username=username.lower()).first()
     if user is None:
-        flash('User {} not found.'.format(first_name))
-        return redirect(url_for('index'))
+        flash('User {} not found.'.format(username))
+        return redirect(url_for('main.index'))
     if user == current_user:
         flash('You cannot follow yourself')
-        return redirect(url_for('user', first_name=first_name))
-    current_user.follow(user)
+        return redirect(url_for('main.user', username=user.username))
+    if current_user.follow(user):
+        notify(user.id, current_user.id, FOLLOWING)
+    timeline.add_followed(current_user, user)
     db.session.commit()
-    flash('You are following {}.'.format(first_name))
-    return redirect(url_for('user', first_name=first_name))
+    flash('You are following {}.'.format(user.username))
+    return redirect(url_for('main.user', username=user.username))
 
 
-@app.route('/unfollow/<first_name>')
+@bp.route('/unfollow/<username>')
 @login_required
-def unfollow(first_name):
-    user = User.query.filter_by(first_name=first_name).first()
+def unfollow(username):
+    user = User.query.filter_by(username=username.lower()).first()
     if user is None:
-        flash('User {} not found.'.format(first_name))
-        return redirect(url_for('index'))
+        flash('User {} not found.'.format(username))
+        return redirect(url_for('main.index'))
     if user == current_user:
         flash('You cannot unfollow yourself!')
-        return redirect(url_for('user', first_name=first_name))
+        return redirect(url_for('main.user', username=user.username))
     current_user.unfollow(user)
+    timeline.remove_followed(current_user, user)
     db.session.commit()
-    flash('You are not following {}.'.format(first_name))
-    return redirect(url_for('user', first_name=first_name))
+    flash('You are not following {}.'.format(user.username))
+    return redirect(url_for('main.user', username=user.username))
+
+
+@bp.route('/events')
+@login_required
+def events():
+    location = request.args.get('location', '').strip()
+    page = paginate_keyset(Event.upcoming(location), current_app.config['EVENTS_PER_PAGE'],
+                           after=request.args.get('after'), before=request.args.get('before'),
+                           columns=(Event.start_time_date, Event.id),
+                           key=lambda event: (event.start_time_date, event.id), oldest_first=True)
+    ids = [event.id for event in page.items]
+    going = {event_id for event_id, in db.session.query(UserToEvent.event_id).filter(
+        UserToEvent.user_id == current_user.id, UserToEvent.event_id.in_(ids))} if ids else set()
+    next_url = url_for('main.events', after=page.next_cursor, location=location or None) if page.has_next else None
+    prev_url = url_for('main.events', before=page.prev_cursor, location=location or None) if page.has_prev else None
+    return render_template('events.html', title='Events', events=page.items, going=going, location=location,
+                           next_url=next_url, prev_url=prev_url)
 
 
-# @app.route('/events')
-# @login_required
-# def events():
-#     pass
-#     return render_template('events.html')
+@bp.route('/event/<int:event_id>/<action>')
+@login_required
+def rsvp(event_id, action):
+    event = Event.query.get_or_404(event_id)
+    if action == 'going':
+        interactions.rsvp_events([(current_user.id, event.id)])
+        db.session.commit()
+    if action == 'cancel':
+        interactions.cancel_rsvps([(current_user.id, event.id)])
+        db.session.commit()
+    return redirect(request.referrer or url_for('main.events'))
+
+
+@bp.route('/calendar')
+@login_required
+def calendar():
+    events = current_user.calendar(since=datetime.utcnow()).all()
+    return render_template('calendar.html', title='Calendar', events=events)
 
 
-@app.route('/like/<int:post_id>/<action>')
+@bp.route('/like/<int:post_id>/<action>')
 @login_required
 def like_action(post_id, action):
     post = Post .query.filter_by(id=post_id).first_or_404()
     if action == 'like':
-        current_user.like_post(post)
+        if current_user.like_post(post):
+            notify(post.user_id, current_user.id, LIKED, post.id)
         db.session.commit()
     if action == 'unlike':
         current_user.unlike_post(post)
@@ -101,42 +282,57 @@ def like_action(post_id, action):
     return redirect(request.referrer)
 
 
-@app.route('/post/<int:post_id>/comment', methods=['GET', 'POST'])
+@bp.route('/post/<int:post_id>/comment', methods=['GET', 'POST'])
 @login_required
 def comment_post(post_id):
     post = Post.query.get_or_404(post_id)
     form = CommentForm()
     if request.method == 'POST':
         if form.validate_on_submit():
-            comment = Comment(body=form.body.data, post_id=post.id)
-            db.session.add(comment)
+            post.add_comment(form.body.data, current_user)
+            notify(post.user_id, current_user.id, COMMENTED, post.id)
             db.session.commit()
-            return redirect(url_for('index', post_id=post.id))
+            return redirect(url_for('main.index', post_id=post.id))
     return redirect(request.referrer)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/post/<int:post_id>/comments')
+@login_required
+@db.replica()
+def comments(post_id):
+    post = Post.query.get_or_404(post_id)
+    page = paginate_keyset(post.get_comments().options(joinedload(Comment.author)),
+                           current_app.config['COMMENTS_PER_PAGE'], after=request.args.get('after'),
+                           before=request.args.get('before'), columns=(Comment.timestamp, Comment.id))
+    next_url = url_for('main.comments', post_id=post.id, after=page.next_cursor) if page.has_next else None
+    prev_url = url_for('main.comments', post_id=post.id, before=page.prev_cursor) if page.has_prev else None
+    return render_template('comments.html', title='Comments', post=post, comments=page.items, form=CommentForm(),
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         login_user(user, remember=form.remember_me.data)
+        db.session.commit()
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
-            next_page = url_for('index')
+            next_page = url_for('main.index')
         return redirect(next_page)
     return render_template('login.html', title='Sign In', form=form)
 
 
-@app.route('/registration', methods=['GET', 'POST'])
+@bp.route('/registration', methods=['GET', 'POST'])
 def registration():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = RegistrationForm()
     if form.validate_on_submit():
         person = User(first_name=form.firstname.data, last_name=form.lastname.data,
@@ -145,155 +341,125 @@ def registration():
         db.session.add(person)
         db.session.commit()
         flash('Congratulations, you are now a registered user!')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Sign up', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/user/<first_name>')
+@bp.route('/user/<username>')
 @login_required
-def user(first_name):
-    user = User.query.filter_by(first_name=first_name).first_or_404()
-    followers = User.followed
-    page = request.args.get('page', 1, type=int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(page, app.config['POSTS_PER_PAGE'], False)
-    next_url = url_for('user', first_name=user.first_name, page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for('user', first_name=user.first_name, page=posts.prev_num) \
-        if posts.has_prev else None
-    return render_template('user.html', user=user, posts=posts.items, followers=followers, next_url=next_url, prev_url=prev_url)
-
-
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@db.replica()
+def user(username):
+    user = User.query.filter_by(username=username.lower()).first_or_404()
+    if streaming():
+        posts, next_url, prev_url = stream_feed(user.posts.order_by(Post.timestamp.desc()), 'main.user',
+                                                username=user.username)
+        return stream_template('user.html', user=user, posts=posts, next_url=next_url, prev_url=prev_url)
+    posts, next_url, prev_url = paginate_feed(user.posts.order_by(Post.timestamp.desc()), 'main.user',
+                                              username=user.username)
+    return render_template('user.html', user=user, posts=posts, next_url=next_url, prev_url=prev_url)
+
+
+def follow_list(user, query, column, endpoint, title):
+    # pages through one side of the followers table along its index
+    page = paginate_by_id(query, column, current_app.config['FOLLOWS_PER_PAGE'], after=request.args.get('after'),
+                          before=request.args.get('before'))
+    next_url = url_for(endpoint, username=user.username, after=page.next_cursor) if page.has_next else None
+    prev_url = url_for(endpoint, username=user.username, before=page.prev_cursor) if page.has_prev else None
+    return render_template('follow_list.html', title=title, user=user, users=page.items,
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/user/<username>/followers')
+@login_required
+def user_followers(username):
+    user = User.query.filter_by(username=username.lower()).first_or_404()
+    return follow_list(user, user.followers, followers.c.follower_id, 'main.user_followers', 'Followers')
+
+
+@bp.route('/user/<username>/following')
+@login_required
+def user_following(username):
+    user = User.query.filter_by(username=username.lower()).first_or_404()
+    return follow_list(user, user.followed, followers.c.followed_id, 'main.user_following', 'Following')
+
+
+@bp.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
-    form = EditProfileForm()
+    form = EditProfileForm(current_user.username)
     if form.validate_on_submit():
         current_user.email = form.email.data
         current_user.user_details = form.v_Status.data
         db.session.commit()
         flash('Your changes have been saved.')
-        return redirect(url_for('user', email=current_user.email))
+        return redirect(url_for('main.user', username=current_user.username))
     elif request.method == 'GET':
         form.email.data = current_user.email
         form.v_Status.data = current_user.user_details
     return render_template('edit_profile.html', title='Edit Profile', form=form)
 
 
-# @app.route('/new_event', methods=['GET', 'POST'])
-# def new_event():
-#     form = EventForm()
-#     if form.validate_on_submit():
-#         event = Event(title=form.name.data, start_time_date=form.date.data, organizer=current_user.first_name)
-#         db.session.add(event)
-#         db.session.commit()
-#         return redirect(url_for('events'))
-#     return render_template('new_event.html', title='New event')
+@bp.route('/new_event', methods=['GET', 'POST'])
+@login_required
+def new_event():
+    form = EventForm()
+    if form.validate_on_submit():
+        event = Event(title=form.name.data, location=form.location.data, start_time_date=form.date.data,
+                      organizer=current_user.id)
+        db.session.add(event)
+        db.session.commit()
+        return redirect(url_for('main.events'))
+    return render_template('new_event.html', title='New event', form=form)
 
 
 def allowed_image(filename):
     if not "." in filename:
         return False
     ext = filename.rsplit(".", 1)[1]
-    if ext.upper() in app.config["ALLOWED_IMAGE_EXTENSIONS"]:
-        return True
-    else:
-        return False
-
-
-def allowed_image_filesize(filesize):
-    if int(filesize) <= app.config["MAX_IMAGE_FILESIZE"]:
+    if ext.upper() in current_app.config["ALLOWED_IMAGE_EXTENSIONS"]:
         return True
     else:
         return False
 
 
-@app.route("/upload-image", methods=["GET", "POST"])
+@bp.route("/upload-image", methods=["GET", "POST"])
+@login_required
 def upload_image():
     if request.method == "POST":
-        if request.files:
-            if "filesize" in request.cookies:
-                if not allowed_image_filesize(request.cookies["filesize"]):
-                    print("Filesize exceeded maximum limit")
-                    return redirect(request.url)
-                image = request.files["image"]
-                if image.filename == "":
-                    print("No filename")
-                    return redirect(request.url)
-                if allowed_image(image.filename):
-                    filename = secure_filename(image.filename)
-                    image.save(os.path.join(app.config["IMAGE_UPLOADS"], filename))
-                    print("Image saved")
-                    return redirect(request.url)
-                else:
-                    print("That file extension is not allowed")
-                    return redirect(request.url)
-    return render_template("public/upload_image.html")
-
-
-@app.route('/reset_db')
-def reset_db():
-    # if current_user.is_authenticated:
-    #     return redirect(url_for('reset_db'))
-    # clear all data from all tables
-    meta = db.metadata
-    for table in reversed(meta.sorted_tables):
-        print('Clear table {}'.format(table))
-        db.session.execute(table.delete())
-    db.session.commit()
-
-    dt1 = datetime(1997, 1, 9)
-    dt2 = datetime(1998, 1, 11)
-    dt3 = datetime(2000, 4, 13)
-
-    dt4 = datetime(2019, 10, 19)
-    dt5 = datetime(2020, 10, 1)
-    dt6 = datetime(2019, 4, 3)
-
-    dt7 = datetime(2019, 12, 19)
-    dt8 = datetime(2019, 12, 20)
-    dt9 = datetime(2019, 12, 20)
-    dt10 = datetime(2019, 12, 21)
-
-    e1 = Event(title='Vegan Pop-Up', location='Brooklyn, Ny', organizer='Louis Garner', start_time_date=dt4)
-    e2 = Event(title='Healthy Eating', location='Bronx, Ny', organizer='Tomas Jennings', start_time_date=dt5)
-    e3 = Event(title='Plant-Based Plantluck', location='Ithaca, Ny', organizer='Tobey Winter', start_time_date=dt6)
-
-    p1 = Post(post_details="I am looking for a vegan event for a kid", likes=5)
-    p2 = Post(post_details="I hosting this event about healthy eating, please check it out", likes=20)
-    p3 = Post(post_details="Hey I am new to the site and looking for friends", likes=100, comments=30, favorites=20)
-
-    u1 = User(first_name='Amber', last_name='Elliott', email="Amber@gmail.com", dob=dt1, user_details='Vegan',
-              posts=[p1])
-    u2 = User(first_name='Frank', last_name='Hood', email="Frank@gmail.com", dob=dt2, user_details='Flexitarian',
-              posts=[p2])
-    u3 = User(first_name='Manon', last_name='Avery', email="Manon@gmail.com", dob=dt3, user_details='Vegetarian',
-              posts=[p3])
-
-    u2e1 = UserToEvent(user=u1, event=e1)
-    u2e2 = UserToEvent(user=u1, event=e2)
-    u2e3 = UserToEvent(user=u2, event=e1)
-    u2e4 = UserToEvent(user=u3, event=e3)
-
-    db.session.add_all([u1, u2, u3, e1, e2, e3, p1, p2, p3, u2e1, u2e2, u2e3, u2e4])
-    db.session.commit()
-
-    # n1 = Notification(recipient_id=u1.id, sender_id=u2.id, timestamp=dt7, type='following')
-    # n2 = Notification(recipient_id=u1.id, sender_id=u2.id, timestamp=dt8, type='commented')
-    # n3 = Notification(recipient_id=u1.id, sender_id=u3.id, timestamp=dt9, type='following')
-    # n4 = Notification(recipient_id=u2.id, sender_id=u3.id, timestamp=dt10, type='like post')
-
-    db.session.add_all([n1, n2, n3, n4])
-
-    u1.set_password("123abc")
-    u2.set_password("xyz")
-    u3.set_password("qwerty")
-
-    db.session.commit()
-
-    return redirect(url_for('index'))
+        image = request.files.get("image")
+        if image is None or image.filename == "":
+            flash("No file selected")
+            return redirect(request.url)
+        if not allowed_image(image.filename):
+            flash("That file extension is not allowed")
+            return redirect(request.url)
+        try:
+            photo, created = photo_store.save(image, current_user, current_app.config["MAX_IMAGE_FILESIZE"])
+        except images.ImageTooLarge:
+            flash("Filesize exceeded maximum limit")
+            return redirect(request.url)
+        db.session.commit()
+        if created:
+            images.process_async(photo_store.path(photo.blob.hash, photo.blob.extension))
+        flash("Image uploaded")
+        return redirect(request.url)
+    return render_template("upload_image.html", title="Upload")
+
+
+@bp.route("/photos/<name>")
+def photo(name):
+    # Blobs never change once written, so the file name doubles as a strong
+    # ETag and clients may cache the response for a year.
+    path = photo_store.resolve(name)
+    if path is None:
+        abort(404)
+    response = send_file(path, conditional=False, add_etags=False)
+    response.set_etag(name)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response.make_conditional(request)
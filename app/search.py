@@ -0,0 +1,234 @@
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db, per_app
+from app.models import Comment, Event, Post, SearchTombstone, User
+from app.snapshots import PeriodicRefresh
+
+TOKEN = re.compile(r'[a-z0-9]+')
+SEARCHABLE = {'post': Post, 'comment': Comment, 'event': Event, 'user': User}
+KIND = {model: kind for kind, model in SEARCHABLE.items()}
+
+# query terms also match every indexed term they are a prefix of, up to this
+# many, at a lower weight than an exact match
+MAX_PREFIX_EXPANSIONS = 50
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def document_text(obj):
+    return ' '.join(str(getattr(obj, field) or '') for field in obj.__searchable__)
+
+
+class InvertedIndex(object):
+    # term -> {document key: term frequency}, plus a sorted term list so a
+    # prefix lookup is a bisect instead of a scan over the vocabulary.
+
+    def __init__(self):
+        self.postings = {}
+        self.terms = []
+        self.lengths = {}
+        self.document_terms = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, key, text):
+        with self._lock:
+            self.remove(key)
+            counts = Counter(tokenize(text))
+            if not counts:
+                return
+            self.lengths[key] = sum(counts.values())
+            self.document_terms[key] = list(counts)
+            for term, count in counts.items():
+                if term not in self.postings:
+                    self.postings[term] = {}
+                    insort(self.terms, term)
+                self.postings[term][key] = count
+
+    def remove(self, key):
+        with self._lock:
+            if self.lengths.pop(key, None) is None:
+                return
+            for term in self.document_terms.pop(key):
+                docs = self.postings[term]
+                del docs[key]
+                if not docs:
+                    del self.postings[term]
+                    del self.terms[bisect_left(self.terms, term)]
+
+    def expand(self, token):
+        start = bisect_left(self.terms, token)
+        expanded = []
+        for term in self.terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            expanded.append((term, 1.0 if term == token else PREFIX_WEIGHT))
+        return expanded
+
+    def search(self, query, limit=50, k1=1.2, b=0.75):
+        # BM25 over every query token; each token counts once per document,
+        # through its best scoring expansion
+        with self._lock:
+            if not self.lengths:
+                return []
+            total = len(self.lengths)
+            average = sum(self.lengths.values()) / total
+            scores = Counter()
+            for token in set(tokenize(query)):
+                best = {}
+                for term, weight in self.expand(token):
+                    docs = self.postings[term]
+                    idf = math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for key, tf in docs.items():
+                        norm = k1 * (1 - b + b * self.lengths[key] / average)
+                        score = weight * idf * tf * (k1 + 1) / (tf + norm)
+                        if score > best.get(key, 0):
+                            best[key] = score
+                scores.update(best)
+            return [key for key, _ in scores.most_common(limit)]
+
+
+class SearchIndex(PeriodicRefresh):
+    # Keeps an InvertedIndex of posts, comments, events and users in sync
+    # with the database. Commits made through this process's session are
+    # applied right away by the session hooks below. Everything else, i.e.
+    # other workers' writes and bulk Core inserts, is caught up at most once
+    # per SEARCH_REFRESH_INTERVAL from the updated_at columns and the
+    # SearchTombstone rows those writes leave behind. Once per
+    # SEARCH_REBUILD_INTERVAL the index is built afresh instead, which also
+    # repairs anything a catch-up missed.
+
+    thread_name = 'search-refresh'
+    interval_setting = 'SEARCH_REFRESH_INTERVAL'
+    background_setting = 'SEARCH_BACKGROUND_REFRESH'
+
+    def __init__(self):
+        PeriodicRefresh.__init__(self)
+        self.index = InvertedIndex()
+        self.checked_at = None
+        self.rebuilt_at = None
+
+    def build(self):
+        if self.rebuilt_at is None or \
+                time.monotonic() - self.rebuilt_at >= current_app.config['SEARCH_REBUILD_INTERVAL']:
+            self._rebuild()
+        else:
+            self._catch_up()
+
+    def rebuild(self):
+        with self._lock:
+            self.rebuilt_at = None
+        self.refresh()
+
+    def _rebuild(self):
+        started = datetime.utcnow()
+        index = InvertedIndex()
+        for kind, model in SEARCHABLE.items():
+            for key, text in _documents(kind, model):
+                index.add(key, text)
+        # swapped in whole; commits applied to the old index meanwhile are
+        # caught up next time, as the scan starts from before this build
+        self.index = index
+        self.checked_at = started
+        self.rebuilt_at = time.monotonic()
+
+    def _catch_up(self):
+        # the overlap covers writes that committed late and clock skew
+        # between workers; re-adding an unchanged document is harmless
+        started = datetime.utcnow()
+        since = self.checked_at - timedelta(seconds=current_app.config['SEARCH_CATCH_UP_OVERLAP'])
+        deleted = db.session.query(SearchTombstone.kind, SearchTombstone.doc_id).filter(
+            SearchTombstone.deleted_at >= since)
+        for kind, doc_id in deleted:
+            self.index.remove((kind, doc_id))
+        for kind, model in SEARCHABLE.items():
+            for key, text in _documents(kind, model, model.updated_at >= since):
+                self.index.add(key, text)
+        self.checked_at = started
+
+    def search(self, query, limit=50):
+        # returns {kind: [objects in rank order]}
+        self.ensure_fresh()
+        keys = self.index.search(query, limit)
+        results = {}
+        for kind, model in SEARCHABLE.items():
+            ids = [id for key_kind, id in keys if key_kind == kind]
+            if ids:
+                by_id = {obj.id: obj for obj in model.query.filter(model.id.in_(ids))}
+                results[kind] = [by_id[id] for id in ids if id in by_id]
+        return results
+
+    def apply(self, changes):
+        for key, text in changes.items():
+            if text is None:
+                self.index.remove(key)
+            else:
+                self.index.add(key, text)
+
+
+def _documents(kind, model, *criteria):
+    columns = [model.id] + [getattr(model, field) for field in model.__searchable__]
+    for row in db.session.query(*columns).filter(*criteria).order_by(model.id).yield_per(1000):
+        yield (kind, row[0]), ' '.join(str(value or '') for value in row[1:])
+
+
+search_index = per_app('search_index')
+
+
+def _stamp_search_changes(session, flush_context, instances):
+    # recorded in the database so every worker's catch-up sees the edit or
+    # delete, not just this process's index; tombstones older than two
+    # rebuild intervals are covered by every worker's rebuild and go
+    now = datetime.utcnow()
+    for obj in session.dirty:
+        if type(obj) in KIND and any(db.inspect(obj).attrs[field].history.has_changes()
+                                     for field in obj.__searchable__):
+            obj.updated_at = now
+    deleted = [obj for obj in session.deleted if type(obj) in KIND]
+    if deleted:
+        session.add_all([SearchTombstone(kind=KIND[type(obj)], doc_id=obj.id, deleted_at=now) for obj in deleted])
+        expired = now - timedelta(seconds=2 * current_app.config['SEARCH_REBUILD_INTERVAL'])
+        session.execute(SearchTombstone.__table__.delete().where(SearchTombstone.deleted_at < expired))
+
+
+def _collect_search_changes(session, flush_context):
+    # the text is captured at flush time, while the attributes are loaded;
+    # nothing is collected until the index has been built
+    if search_index.refreshed_at is None:
+        return
+    changes = session.info.setdefault('search_changes', {})
+    for obj in session.new | session.dirty:
+        if type(obj) in KIND:
+            changes[(KIND[type(obj)], obj.id)] = document_text(obj)
+    for obj in session.deleted:
+        if type(obj) in KIND:
+            changes[(KIND[type(obj)], obj.id)] = None
+
+
+def _apply_search_changes(session):
+    changes = session.info.pop('search_changes', None)
+    if changes:
+        search_index.apply(changes)
+
+
+def _forget_search_changes(session):
+    session.info.pop('search_changes', None)
+
+
+db.event.listen(db.session, 'before_flush', _stamp_search_changes)
+db.event.listen(db.session, 'after_flush', _collect_search_changes)
+db.event.listen(db.session, 'after_commit', _apply_search_changes)
+db.event.listen(db.session, 'after_rollback', _forget_search_changes)
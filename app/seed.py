@@ -0,0 +1,220 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from app import db, passwords, timeline
+from app.interactions import insert_ignore
+from app.models import Comment, Event, Notification, Post, PostLike, User, UserToEvent, followers, location_key, \
+    reconcile_counters
+
+# Bulk import for flask seed. Every source is a stream of dicts named after
+# what it holds; rows are converted by column type, written with Core
+# executemany in batches and never become ORM objects. Counters and push
+# timelines are recomputed once at the end.
+
+# source name -> table, in load order
+TABLES = [
+    ('users', User.__table__),
+    ('events', Event.__table__),
+    ('posts', Post.__table__),
+    ('follows', followers),
+    ('likes', PostLike.__table__),
+    ('comments', Comment.__table__),
+    ('attendees', UserToEvent.__table__),
+    ('notifications', Notification.__table__),
+]
+# link tables, where a duplicate row is skipped instead of failing the load
+IGNORE_DUPLICATES = {'follows', 'likes', 'attendees'}
+EXTENSIONS = ('.jsonl', '.csv')
+
+
+def find_sources(paths):
+    # files named <source>.jsonl or <source>.csv, given directly or found in
+    # the given directories; returned in load order
+    files = {}
+    for path in paths:
+        candidates = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) \
+            else [path]
+        for candidate in candidates:
+            name, extension = os.path.splitext(os.path.basename(candidate))
+            if extension in EXTENSIONS and name in dict(TABLES):
+                files[name] = candidate
+            elif not os.path.isdir(path):
+                raise ValueError('Cannot tell what {} holds, expected one of {}'.format(
+                    candidate, ', '.join(name + ext for name, _ in TABLES for ext in EXTENSIONS)))
+    return [(name, read_rows(files[name])) for name, _ in TABLES if name in files]
+
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _parse_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _converters(table):
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, db.Integer):
+            converters[column.key] = int
+        elif isinstance(column.type, db.DateTime):
+            converters[column.key] = _parse_datetime
+        else:
+            converters[column.key] = str
+    return converters
+
+
+def _convert(name, row, converters):
+    converted = {}
+    for key, value in row.items():
+        if key not in converters:
+            raise ValueError('Unknown column {!r} in {}'.format(key, name))
+        # a missing or empty value leaves the column to its default, or null
+        if value is not None and value != '':
+            converted[key] = converters[key](value)
+    return converted
+
+
+class Loader(object):
+    def __init__(self, batch_size=10000, hash_workers=None):
+        self.batch_size = batch_size
+        # hashing is the slow part of importing users, so it is spread over
+        # processes; hash_workers=0 hashes in this process
+        self.pool = ProcessPoolExecutor(hash_workers) if hash_workers != 0 else None
+        self.usernames = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def load(self, name, rows):
+        table = dict(TABLES)[name]
+        converters = _converters(table)
+        if name == 'users':
+            converters['password'] = str
+        loaded = 0
+        rows = iter(rows)
+        while True:
+            batch = [_convert(name, row, converters) for row in islice(rows, self.batch_size)]
+            if not batch:
+                return loaded
+            if name == 'users':
+                self._prepare_users(batch)
+            elif name == 'events':
+                for row in batch:
+                    row['location_key'] = location_key(row.get('location'))
+            # executemany needs the same keys in every row, and leaving a key
+            # out lets its column default apply
+            groups = {}
+            for row in batch:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            for group in groups.values():
+                if name in IGNORE_DUPLICATES:
+                    insert_ignore(table, group)
+                else:
+                    db.session.execute(table.insert(), group)
+            db.session.commit()
+            loaded += len(batch)
+
+    def _prepare_users(self, batch):
+        plain = [row for row in batch if row.get('password') is not None]
+        plain_passwords = [row.pop('password') for row in plain]
+        hasher = passwords.hasher()
+        hashes = self.pool.map(hasher, plain_passwords, chunksize=64) if self.pool is not None \
+            else map(hasher, plain_passwords)
+        for row, password_hash in zip(plain, hashes):
+            row['password_hash'] = password_hash
+        for row in batch:
+            row.pop('password', None)
+        if self.usernames is None:
+            self.usernames = {username for username, in db.session.query(User.username)}
+        for row in batch:
+            if row.get('username'):
+                row['username'] = row['username'].lower()
+            else:
+                base = User.username_base(row.get('first_name'), row.get('last_name'))
+                row['username'] = User.first_free_username(base, self.usernames)
+            self.usernames.add(row['username'])
+
+
+def reset():
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+    db.session.commit()
+
+
+def load(sources, batch_size=10000, hash_workers=None, drop_indexes=False, log=lambda message: None):
+    # sources are (name, rows) pairs in load order; returns rows loaded per name
+    tables = [dict(TABLES)[name] for name, _ in sources]
+    dropped = []
+    if drop_indexes:
+        # unique indexes stay, they are what rejects bad rows
+        dropped = [index for table in tables for index in table.indexes if not index.unique]
+        for index in dropped:
+            index.drop(db.engine)
+    loader = Loader(batch_size, hash_workers)
+    counts = {}
+    try:
+        for name, rows in sources:
+            start = time.monotonic()
+            counts[name] = loader.load(name, rows)
+            log('{}: {} rows in {:.1f}s'.format(name, counts[name], time.monotonic() - start))
+    finally:
+        loader.close()
+        db.session.rollback()
+        for index in dropped:
+            index.create(db.engine)
+    if dropped:
+        log('{} indexes rebuilt'.format(len(dropped)))
+    reconcile_counters()
+    if timeline.enabled():
+        timeline.rebuild()
+    db.session.commit()
+    log('counters{} recomputed'.format(' and timelines' if timeline.enabled() else ''))
+    return counts
+
+
+DEMO = [
+    ('users', [
+        {'id': 1, 'first_name': 'Amber', 'last_name': 'Elliott', 'email': 'Amber@gmail.com', 'dob': '1997-01-09',
+         'user_details': 'Vegan', 'password': '123abc'},
+        {'id': 2, 'first_name': 'Frank', 'last_name': 'Hood', 'email': 'Frank@gmail.com', 'dob': '1998-01-11',
+         'user_details': 'Flexitarian', 'password': 'xyz'},
+        {'id': 3, 'first_name': 'Manon', 'last_name': 'Avery', 'email': 'Manon@gmail.com', 'dob': '2000-04-13',
+         'user_details': 'Vegetarian', 'password': 'qwerty'},
+    ]),
+    ('events', [
+        {'id': 1, 'title': 'Vegan Pop-Up', 'location': 'Brooklyn, Ny', 'start_time_date': '2019-10-19'},
+        {'id': 2, 'title': 'Healthy Eating', 'location': 'Bronx, Ny', 'start_time_date': '2020-10-01'},
+        {'id': 3, 'title': 'Plant-Based Plantluck', 'location': 'Ithaca, Ny', 'start_time_date': '2019-04-03'},
+    ]),
+    ('posts', [
+        {'id': 1, 'user_id': 1, 'post_details': 'I am looking for a vegan event for a kid'},
+        {'id': 2, 'user_id': 2, 'post_details': 'I hosting this event about healthy eating, please check it out'},
+        {'id': 3, 'user_id': 3, 'post_details': 'Hey I am new to the site and looking for friends'},
+    ]),
+    ('attendees', [
+        {'user_id': 1, 'event_id': 1},
+        {'user_id': 1, 'event_id': 2},
+        {'user_id': 2, 'event_id': 1},
+        {'user_id': 3, 'event_id': 3},
+    ]),
+    ('notifications', [
+        {'recipient_id': 1, 'sender_id': 2, 'timestamp': '2019-12-19', 'type': 'following'},
+        {'recipient_id': 1, 'sender_id': 2, 'timestamp': '2019-12-20', 'type': 'commented'},
+        {'recipient_id': 1, 'sender_id': 3, 'timestamp': '2019-12-20', 'type': 'following'},
+        {'recipient_id': 2, 'sender_id': 3, 'timestamp': '2019-12-21', 'type': 'like post'},
+    ]),
+]
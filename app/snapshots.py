@@ -0,0 +1,67 @@
+import threading
+import time
+
+from flask import current_app
+
+from app import db
+
+
+class PeriodicRefresh(object):
+    # Base for per-process state rebuilt from the database at most once per
+    # interval_setting seconds. Subclasses implement build() and call
+    # ensure_fresh() before reading. With background_setting on, a daemon
+    # thread does every build, the first one included, and readers get
+    # whatever is current, empty until that first build lands. With it off,
+    # the reader that finds the state stale rebuilds it inline.
+
+    thread_name = None
+    interval_setting = None
+    background_setting = None
+
+    def __init__(self):
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def build(self):
+        raise NotImplementedError
+
+    def ensure_fresh(self):
+        config = current_app.config
+        if config[self.background_setting]:
+            self._start(current_app._get_current_object())
+        elif self.is_stale(config[self.interval_setting]):
+            self.refresh(max_age=config[self.interval_setting])
+
+    def is_stale(self, max_age):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at >= max_age
+
+    def refresh(self, max_age=None):
+        # with max_age, a caller that queued on the lock behind another
+        # refresh finds the state fresh and returns instead of building again
+        with self._lock:
+            if max_age is not None and not self.is_stale(max_age):
+                return
+            self.build()
+            self.refreshed_at = time.monotonic()
+
+    def _start(self, app):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,), name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _run(self, app):
+        while True:
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    app.logger.exception('%s failed', self.thread_name)
+                finally:
+                    db.session.remove()
+            time.sleep(app.config[self.interval_setting])
@@ -0,0 +1,62 @@
+import os
+import re
+
+from werkzeug.utils import secure_filename
+
+from app import db, images, photos
+from app.interactions import insert_ignore
+from app.models import Photo, PhotoBlob
+
+BLOB_NAME = re.compile(r'^(?P<hash>[0-9a-f]{64})(?:_(?P<variant>[a-z]+))?\.(?P<extension>[a-z0-9]+)$')
+
+
+class PhotoStore(object):
+    # Content-addressed storage under the root of the photos UploadSet. Every
+    # distinct image is written once to <root>/ab/cd/<sha256>.<ext>, next to
+    # its resized variants, and every upload is recorded as a Photo row
+    # pointing at that blob.
+
+    def __init__(self, upload_set):
+        self.upload_set = upload_set
+
+    @property
+    def root(self):
+        return self.upload_set.config.destination
+
+    def path(self, hash, extension):
+        return os.path.join(self.root, hash[:2], hash[2:4], '{}.{}'.format(hash, extension))
+
+    def save(self, image, user, max_size):
+        # returns the new Photo and whether its content was new to the store
+        tmp_path, hash = images.stream_to_disk(image.stream, self.root, max_size)
+        blob = PhotoBlob.query.get(hash)
+        created = False
+        if blob is None:
+            # a concurrent upload of the same content may insert the row
+            # first; this one is then skipped and the winner's row used
+            row = {'hash': hash, 'extension': images.extension(image.filename), 'size': os.path.getsize(tmp_path)}
+            created = insert_ignore(PhotoBlob.__table__, [row]) != 0
+            blob = PhotoBlob.query.get(hash)
+        if created:
+            path = self.path(hash, blob.extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+        photo = Photo(user_id=user.id, blob=blob, filename=secure_filename(image.filename))
+        db.session.add(photo)
+        return photo, created
+
+    def resolve(self, name):
+        # maps a public name such as <sha256>.png or <sha256>_thumb.jpg to a
+        # file on disk, or None
+        match = BLOB_NAME.match(name)
+        if match is None:
+            return None
+        path = self.path(match.group('hash'), match.group('extension'))
+        if match.group('variant'):
+            path = images.variant_path(path, match.group('variant'))
+        return path if os.path.isfile(path) else None
+
+
+photo_store = PhotoStore(photos)
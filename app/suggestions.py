@@ -0,0 +1,97 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from flask import current_app
+
+from app import db, per_app
+from app.models import User, UserToEvent, followers
+from app.snapshots import PeriodicRefresh
+
+
+def _sorted_array(ids):
+    return array('l', sorted(ids))
+
+
+def _contains(ids, id):
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+class SuggestionGraph(PeriodicRefresh):
+    # "Who to follow" for every user, computed from a snapshot of the social
+    # graph at most once per SUGGESTION_REFRESH_INTERVAL. The snapshot keeps
+    # each user's follows and each event's attendees as sorted integer arrays,
+    # and a request only does a dict lookup into the precomputed suggestions.
+    # A refresh builds new dicts and swaps them in with a single assignment.
+
+    thread_name = 'suggestion-refresh'
+    interval_setting = 'SUGGESTION_REFRESH_INTERVAL'
+    background_setting = 'SUGGESTION_BACKGROUND_REFRESH'
+
+    def __init__(self):
+        PeriodicRefresh.__init__(self)
+        self.suggestions = {}
+
+    def suggested_ids(self, user_id):
+        self.ensure_fresh()
+        return self.suggestions.get(user_id, ())
+
+    def build(self):
+        following, attendees = load_graph()
+        self.suggestions = suggest(following, attendees, current_app.config)
+
+
+def load_graph():
+    # two full scans in primary key order, one per edge table
+    following = defaultdict(list)
+    for follower_id, followed_id in db.session.query(followers.c.follower_id, followers.c.followed_id):
+        following[follower_id].append(followed_id)
+    attendees = defaultdict(list)
+    for event_id, user_id in db.session.query(UserToEvent.event_id, UserToEvent.user_id):
+        attendees[event_id].append(user_id)
+    return ({user_id: _sorted_array(ids) for user_id, ids in following.items()},
+            {event_id: _sorted_array(ids) for event_id, ids in attendees.items()})
+
+
+def suggest(following, attendees, config):
+    # Scores everyone two hops away: once per followed user who follows them
+    # and SUGGESTION_EVENT_WEIGHT per shared event. Events with more than
+    # SUGGESTION_MAX_EVENT_SIZE attendees say little about who knows whom and
+    # are skipped. Keeps the best SUGGESTIONS_PER_USER per user.
+    events = defaultdict(list)
+    for event_id, user_ids in attendees.items():
+        if len(user_ids) <= config['SUGGESTION_MAX_EVENT_SIZE']:
+            for user_id in user_ids:
+                events[user_id].append(event_id)
+    suggestions = {}
+    empty = array('l')
+    for user_id in set(following) | set(events):
+        followed = following.get(user_id, empty)
+        scores = Counter()
+        for friend_id in followed:
+            scores.update(following.get(friend_id, empty))
+        for event_id in events.get(user_id, ()):
+            for other_id in attendees[event_id]:
+                scores[other_id] += config['SUGGESTION_EVENT_WEIGHT']
+        scores.pop(user_id, None)
+        candidates = ((-score, other_id) for other_id, score in scores.items() if not _contains(followed, other_id))
+        best = [other_id for _, other_id in heapq.nsmallest(config['SUGGESTIONS_PER_USER'], candidates)]
+        if best:
+            suggestions[user_id] = array('l', best)
+    return suggestions
+
+
+def suggested_users(user, limit):
+    # drops anyone the user followed since the last refresh
+    ids = list(suggestion_graph.suggested_ids(user.id))
+    if not ids:
+        return []
+    followed = db.session.query(followers.c.followed_id).filter(followers.c.follower_id == user.id,
+                                                                 followers.c.followed_id.in_(ids))
+    by_id = {other.id: other for other in User.query.filter(User.id.in_(ids), ~User.id.in_(followed))}
+    return [by_id[id] for id in ids if id in by_id][:limit]
+
+
+suggestion_graph = per_app('suggestion_graph')
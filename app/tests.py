@@ -1,18 +1,109 @@
+from array import array
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
-from app import app, db
-from app.models import User, Post
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from app import create_app, db, seed, timeline, user_cache, fragment_cache, unread_cache, interactions, images, \
+    passwords
+from app.database import PRIMARY_UNTIL
+from app.cache import MemoryBackend
+from app.models import User, Post, PostLike, Comment, Event, UserToEvent, TimelineEntry, PhotoBlob, Notification, \
+    NotificationOutbox, SearchTombstone, hydrate_posts, reconcile_counters, load_user, followers
+from app.explore import explore_feed, rank_posts
+from app.instrumentation import query_stats, request_logger
+from app.pagination import paginate_keyset, paginate_by_id, decode_cursor
+from app.notifications import notification_queue, notify
+from app.search import InvertedIndex, SearchIndex, search_index
+from app.snapshots import PeriodicRefresh
+from app.storage import photo_store
+from app.suggestions import suggestion_graph, suggest, suggested_users
+from benchmarks import boot as bench_boot, generate as bench_generate, report as bench_report, \
+    runner as bench_runner
+from flask import url_for
+from flask_uploads import UploadConfiguration
+from werkzeug.datastructures import FileStorage
+from config import Config
 
+try:
+    import PIL
+except ImportError:
+    PIL = None
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    REQUEST_LOG = False
+
+
+app = create_app(TestConfig)
+
+
+def count_queries(func):
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return len(queries)
+
+
+def racing_insert(prefix, sql, parameters, func):
+    # runs sql on the same cursor right before the first statement starting
+    # with prefix, like a concurrent request writing the row first
+    pending = [True]
+
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        if pending and statement.startswith(prefix):
+            pending.pop()
+            cursor.execute(sql, parameters)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        return func()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class AppTestCase(unittest.TestCase):
+    # Runs each test in an app context on fresh tables, with empty caches and
+    # refreshers that rebuild on first use. config is applied on top of the
+    # app's, and whatever the test changes is put back afterwards.
+    config = {}
 
-class UserModelCase(unittest.TestCase):
     def setUp(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.saved_config = dict(app.config)
+        app.config.update(self.config)
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.create_all()
+        for cache in (user_cache, fragment_cache, unread_cache):
+            cache.clear()
+        for refresher in (explore_feed, search_index, suggestion_graph):
+            refresher.refreshed_at = None
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
+        app.config.clear()
+        app.config.update(self.saved_config)
+
 
+class UserModelCase(AppTestCase):
     def test_password_hashing(self):
         u = User(first_name='susan')
         u.set_password('cat')
@@ -81,5 +172,1300 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f4, [p4])
 
 
+class UsernameCase(AppTestCase):
+    def test_new_users_get_unique_usernames(self):
+        users = [User(first_name='John', last_name='Smith', email='{}@example.com'.format(i)) for i in range(3)]
+        db.session.add_all(users[:2])
+        db.session.commit()
+        db.session.add(users[2])
+        db.session.commit()
+        self.assertEqual(sorted(u.username for u in users), ['john.smith', 'john.smith2', 'john.smith3'])
+
+    def test_username_lookup_is_case_insensitive(self):
+        u = User(first_name='Mary', username='Mary.Jane', email='mary@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.username, 'mary.jane')
+        self.assertEqual(User.query.filter_by(username='MARY.jane'.lower()).first(), u)
+        self.assertEqual(User.make_unique_username('Mary', 'Jane'), 'mary.jane2')
+
+
+class FeedCase(AppTestCase):
+    def make_posts(self, count):
+        viewer = User(first_name='john', email='john@example.com')
+        author = User(first_name='susan', email='susan@example.com')
+        db.session.add_all([viewer, author])
+        now = datetime.utcnow()
+        posts = [Post(post_details='post {}'.format(i), author=author, timestamp=now + timedelta(seconds=i))
+                 for i in range(count)]
+        db.session.add_all(posts)
+        db.session.commit()
+        for i, post in enumerate(posts):
+            author.like_post(post)
+            if i % 2 == 0:
+                viewer.like_post(post)
+            for j in range(i):
+                post.add_comment('comment {}'.format(j))
+        db.session.commit()
+        return viewer, [post.id for post in posts]
+
+    def test_hydrate_posts(self):
+        viewer, ids = self.make_posts(5)
+        db.session.expire_all()
+        posts = hydrate_posts(Post.query.filter(Post.id.in_(ids)).order_by(Post.id), viewer, 3)
+        self.assertEqual([p.like_count for p in posts], [2, 1, 2, 1, 2])
+        self.assertEqual([p.stats.liked for p in posts], [True, False, True, False, True])
+        self.assertEqual([p.comment_count for p in posts], [0, 1, 2, 3, 4])
+        self.assertEqual([c.body for c in posts[4].stats.comments], ['comment 3', 'comment 2', 'comment 1'])
+        self.assertEqual(posts[0].stats.comments, [])
+
+    def test_hydrate_posts_query_count_is_constant(self):
+        viewer, ids = self.make_posts(10)
+
+        def render(count):
+            db.session.expire_all()
+            posts = Post.query.filter(Post.id.in_(ids[:count])).all()
+            return count_queries(lambda: [(p.author.first_name, p.like_count, p.comment_count)
+                                               for p in hydrate_posts(posts, viewer, 3)])
+
+        self.assertEqual(render(2), render(10))
+
+
+class TimelineCase(AppTestCase):
+    config = {'TIMELINE_MODE': 'push'}
+
+    def test_push_timeline_matches_pull_query(self):
+        u1 = User(first_name='john', email='john@example.com')
+        u2 = User(first_name='susan', email='susan@example.com')
+        u3 = User(first_name='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        now = datetime.utcnow()
+        posts = []
+        for i, author in enumerate([u1, u2, u3, u2]):
+            post = Post(post_details='post {}'.format(i), author=author, timestamp=now + timedelta(seconds=i))
+            db.session.add(post)
+            timeline.fan_out_post(post)
+            posts.append(post)
+        db.session.commit()
+        self.assertEqual(timeline.home_posts(u1).all(), [posts[0]])
+
+        u1.follow(u2)
+        timeline.add_followed(u1, u2)
+        timeline.add_followed(u1, u2)
+        db.session.commit()
+        self.assertEqual(timeline.home_posts(u1).all(), u1.followed_posts().all())
+        self.assertEqual(timeline.home_posts(u1).all(), [posts[3], posts[1], posts[0]])
+
+        post = Post(post_details='post 4', author=u2, timestamp=now + timedelta(seconds=4))
+        db.session.add(post)
+        timeline.fan_out_post(post)
+        db.session.commit()
+        self.assertEqual(timeline.home_posts(u1).first(), post)
+
+        u1.unfollow(u2)
+        timeline.remove_followed(u1, u2)
+        db.session.commit()
+        self.assertEqual(timeline.home_posts(u1).all(), [posts[0]])
+
+    def test_bulk_follows_fill_timeline(self):
+        u1 = User(first_name='john', email='john@example.com')
+        u2 = User(first_name='susan', email='susan@example.com')
+        db.session.add_all([u1, u2, Post(post_details='post from susan', author=u2)])
+        db.session.commit()
+        interactions.follow_users([(u1.id, u2.id)])
+        db.session.commit()
+        self.assertEqual(timeline.home_posts(u1).all(), u1.followed_posts().all())
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=u1.id).count(), 1)
+
+    def test_rebuild(self):
+        u1 = User(first_name='john', email='john@example.com')
+        u2 = User(first_name='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.add_all([Post(post_details='post from john', author=u1),
+                            Post(post_details='post from susan', author=u2)])
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.count(), 0)
+        timeline.rebuild()
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=u1.id).count(), 2)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=u2.id).count(), 1)
+        self.assertEqual(timeline.home_posts(u1).all(), u1.followed_posts().all())
+
+
+class FragmentCacheCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False, 'EXPLORE_BACKGROUND_REFRESH': False, 'SUGGESTION_BACKGROUND_REFRESH': False}
+
+    def setUp(self):
+        super().setUp()
+        u = User(first_name='john', email='john@example.com')
+        u.set_password('cat')
+        db.session.add_all([u, Post(post_details='post from john', author=u)])
+        db.session.commit()
+        self.client = app.test_client()
+        self.client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+    def test_post_fragment_is_cached_until_the_post_changes(self):
+        first = self.client.get('/explore').data
+        self.assertIn(b'0 likes', first)
+        self.assertEqual(fragment_cache.stats(), {'hits': 0, 'misses': 1})
+        queries = count_queries(lambda: self.assertEqual(self.client.get('/explore').data, first))
+        self.assertEqual(fragment_cache.stats(), {'hits': 1, 'misses': 1})
+        self.assertLessEqual(queries, 3)
+
+        self.client.get('/like/1/like', headers={'Referer': '/explore'})
+        page = self.client.get('/explore').data
+        self.assertIn(b'1 likes', page)
+        self.assertIn(b'Unlike', page)
+        self.assertEqual(fragment_cache.stats(), {'hits': 1, 'misses': 2})
+
+
+class ExploreCase(AppTestCase):
+    config = {'EXPLORE_BACKGROUND_REFRESH': False}
+
+    def test_rank_posts(self):
+        now = datetime.utcnow()
+        users = [User(first_name='user{}'.format(i), email='{}@example.com'.format(i)) for i in range(4)]
+        db.session.add_all(users)
+        quiet_new = Post(post_details='quiet new', author=users[0], timestamp=now - timedelta(hours=1))
+        quiet_old = Post(post_details='quiet old', author=users[0], timestamp=now - timedelta(hours=5))
+        busy_old = Post(post_details='busy old', author=users[0], timestamp=now - timedelta(hours=5))
+        db.session.add_all([quiet_new, quiet_old, busy_old])
+        db.session.commit()
+        for user in users:
+            user.like_post(busy_old)
+        busy_old.add_comment('great')
+        db.session.commit()
+        self.assertEqual(rank_posts(app.config, now), [busy_old.id, quiet_new.id, quiet_old.id])
+        later = now + timedelta(hours=100)
+        self.assertEqual(rank_posts(app.config, later), [quiet_new.id, busy_old.id, quiet_old.id])
+
+    def test_snapshot_is_reused_between_refreshes(self):
+        u = User(first_name='john', email='john@example.com')
+        db.session.add_all([u, Post(post_details='first', author=u)])
+        db.session.commit()
+        self.assertEqual(len(explore_feed.ranked_ids()), 1)
+        db.session.add(Post(post_details='second', author=u))
+        db.session.commit()
+        self.assertEqual(count_queries(explore_feed.ranked_ids), 0)
+        self.assertEqual(len(explore_feed.ranked_ids()), 1)
+        explore_feed.refresh()
+        self.assertEqual(len(explore_feed.ranked_ids()), 2)
+
+    def test_refresh_skips_when_another_caller_just_refreshed(self):
+        explore_feed.refresh()
+        self.assertEqual(count_queries(lambda: explore_feed.refresh(max_age=60)), 0)
+        self.assertGreater(count_queries(lambda: explore_feed.refresh(max_age=0)), 0)
+
+    def test_background_mode_never_builds_in_the_request(self):
+        built = []
+        done = threading.Event()
+
+        class Snapshot(PeriodicRefresh):
+            thread_name = 'test-refresh'
+            interval_setting = 'EXPLORE_REFRESH_INTERVAL'
+            background_setting = 'EXPLORE_BACKGROUND_REFRESH'
+
+            def build(self):
+                built.append(threading.current_thread())
+                done.set()
+
+        snapshot = Snapshot()
+        app.config['EXPLORE_BACKGROUND_REFRESH'] = True
+        snapshot.ensure_fresh()
+        snapshot.ensure_fresh()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(built, [snapshot._thread])
+
+
+class CountersCase(AppTestCase):
+    def test_counters_follow_writes(self):
+        u1 = User(first_name='john', email='john@example.com')
+        u2 = User(first_name='susan', email='susan@example.com')
+        post = Post(post_details='post from susan', author=u2)
+        db.session.add_all([u1, u2, post])
+        db.session.commit()
+
+        u1.like_post(post)
+        u1.like_post(post)
+        u2.like_post(post)
+        post.add_comment('nice')
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual((post.like_count, post.comment_count), (2, 1))
+        self.assertEqual((u1.followed_count, u1.follower_count), (1, 0))
+        self.assertEqual((u2.followed_count, u2.follower_count), (0, 1))
+
+        u1.unlike_post(post)
+        u1.unlike_post(post)
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(post.like_count, 1)
+        self.assertEqual((u1.followed_count, u2.follower_count), (0, 0))
+
+    def test_reconcile_counters(self):
+        u1 = User(first_name='john', email='john@example.com')
+        u2 = User(first_name='susan', email='susan@example.com')
+        post = Post(post_details='post from susan', author=u2)
+        db.session.add_all([u1, u2, post])
+        db.session.commit()
+        db.session.add(PostLike(user_id=u1.id, post_id=post.id))
+        db.session.add(Comment(body='nice', post_id=post.id))
+        u2.followed.append(u1)
+        u1.follower_count = 5
+        u2.unread_notification_count = 3
+        db.session.add(Notification(recipient_id=u2.id, sender_id=u1.id, type='following'))
+        db.session.commit()
+
+        fixed = reconcile_counters()
+        db.session.commit()
+        self.assertEqual(fixed, {'post.like_count': 1, 'post.comment_count': 1,
+                                 'user.follower_count': 1, 'user.followed_count': 1, 'event.attendee_count': 0,
+                                 'user.unread_notification_count': 1})
+        db.session.expire_all()
+        self.assertEqual((post.like_count, post.comment_count), (1, 1))
+        self.assertEqual((u1.follower_count, u2.followed_count), (1, 1))
+        self.assertEqual(u2.unread_notification_count, 1)
+        self.assertEqual(sum(reconcile_counters().values()), 0)
+
+
+class UserCacheCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        u = User(first_name='john', email='john@example.com', user_details='Vegan')
+        db.session.add(u)
+        db.session.commit()
+        self.id = str(u.id)
+        db.session.remove()
+
+    def test_load_user_is_cached(self):
+        self.assertEqual(count_queries(lambda: load_user(self.id)), 1)
+        db.session.remove()
+        users = []
+        self.assertEqual(count_queries(lambda: users.append(load_user(self.id))), 0)
+        self.assertEqual(users[0].email, 'john@example.com')
+        self.assertEqual(users[0].follower_count, 0)
+        self.assertEqual(user_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_profile_change_invalidates(self):
+        u = load_user(self.id)
+        u.user_details = 'Flexitarian'
+        db.session.flush()
+        self.assertIsNotNone(user_cache.get(int(self.id)))
+        db.session.commit()
+        self.assertIsNone(user_cache.get(int(self.id)))
+        db.session.remove()
+        self.assertEqual(load_user(self.id).user_details, 'Flexitarian')
+
+    def test_memory_backend_lru_and_ttl(self):
+        backend = MemoryBackend(maxsize=2, ttl=60)
+        backend.set(1, 'a')
+        backend.set(2, 'b')
+        backend.get(1)
+        backend.set(3, 'c')
+        self.assertEqual((backend.get(1), backend.get(2), backend.get(3)), ('a', None, 'c'))
+        expired = MemoryBackend(ttl=0)
+        expired.set(1, 'a')
+        self.assertIsNone(expired.get(1))
+
+
+class InteractionsCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [User(first_name='user{}'.format(i), email='{}@example.com'.format(i)) for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.posts = [Post(post_details='post {}'.format(i), author=self.users[0]) for i in range(3)]
+        db.session.add_all(self.posts)
+        db.session.commit()
+
+    def test_like_posts(self):
+        u, p = [u.id for u in self.users], [p.id for p in self.posts]
+        self.users[1].like_post(self.posts[0])
+        db.session.commit()
+        pairs = [(u[1], p[0]), (u[1], p[1]), (u[2], p[1]), (u[2], p[1]), (u[3], p[2])]
+        statements = count_queries(lambda: self.assertEqual(interactions.like_posts(pairs), 3))
+        db.session.commit()
+        self.assertEqual(statements, 3)
+        self.assertEqual(PostLike.query.count(), 4)
+        self.assertEqual([post.like_count for post in self.posts], [1, 2, 1])
+        self.assertEqual(interactions.like_posts(pairs), 0)
+
+    def test_like_posts_counts_only_inserted_rows(self):
+        u, p = [u.id for u in self.users], [p.id for p in self.posts]
+        liked = racing_insert('INSERT OR IGNORE INTO post_like',
+                              'INSERT INTO post_like (user_id, post_id) VALUES (?, ?)', (u[1], p[0]),
+                              lambda: interactions.like_posts([(u[1], p[0]), (u[2], p[0])]))
+        db.session.commit()
+        self.assertEqual(liked, 1)
+        self.assertEqual(self.posts[0].like_count, 2)
+
+    def test_follow_users(self):
+        u = [u.id for u in self.users]
+        self.users[1].follow(self.users[0])
+        db.session.commit()
+        self.assertEqual(interactions.follow_users([(u[1], u[0]), (u[2], u[0]), (u[2], u[2]), (u[3], u[2])]), 2)
+        db.session.commit()
+        self.assertEqual(self.users[0].followers.count(), 2)
+        self.assertEqual([user.follower_count for user in self.users], [2, 0, 1, 0])
+        self.assertEqual([user.followed_count for user in self.users], [0, 1, 1, 1])
+        self.assertEqual(sum(reconcile_counters().values()), 0)
+
+    def test_follow_users_counts_only_inserted_rows(self):
+        u = [u.id for u in self.users]
+        followed = racing_insert('INSERT OR IGNORE INTO followers',
+                                 'INSERT INTO followers (follower_id, followed_id) VALUES (?, ?)', (u[1], u[0]),
+                                 lambda: interactions.follow_users([(u[1], u[0]), (u[2], u[0])]))
+        db.session.commit()
+        self.assertEqual(followed, 1)
+        self.assertEqual([user.follower_count for user in self.users], [2, 0, 0, 0])
+        self.assertEqual([user.followed_count for user in self.users], [0, 1, 1, 0])
+
+    def test_add_comments(self):
+        p = [p.id for p in self.posts]
+        u = self.users[1].id
+        self.assertEqual(interactions.add_comments([(p[0], u, 'a'), (p[0], u, 'a'), (p[2], u, 'b')]), 3)
+        db.session.commit()
+        self.assertEqual([post.comment_count for post in self.posts], [2, 0, 1])
+        self.assertEqual({comment.author for comment in Comment.query}, {self.users[1]})
+        self.assertEqual(sum(reconcile_counters().values()), 0)
+
+
+class KeysetPaginationCase(AppTestCase):
+    def test_walk_followed_posts(self):
+        u1 = User(first_name='john', email='john@example.com')
+        u2 = User(first_name='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        now = datetime.utcnow()
+        # pairs of posts share a timestamp, so the id has to break ties
+        posts = [Post(post_details='post {}'.format(i), author=[u1, u2][i % 2],
+                      timestamp=now + timedelta(seconds=i // 2)) for i in range(7)]
+        db.session.add_all(posts)
+        u1.follow(u2)
+        db.session.commit()
+        expected = sorted(posts, key=lambda p: (p.timestamp, p.id), reverse=True)
+
+        pages, cursor = [], None
+        while True:
+            page = paginate_keyset(u1.followed_posts(), 3, after=cursor)
+            pages.append(page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual([p for page in pages for p in page.items], expected)
+        self.assertEqual([len(page.items) for page in pages], [3, 3, 1])
+        self.assertFalse(pages[0].has_prev)
+
+        back = paginate_keyset(u1.followed_posts(), 3, before=pages[2].prev_cursor)
+        self.assertEqual(back.items, pages[1].items)
+        self.assertTrue(back.has_prev)
+        first = paginate_keyset(u1.followed_posts(), 3, before=back.prev_cursor)
+        self.assertEqual(first.items, pages[0].items)
+        self.assertFalse(first.has_prev)
+
+    def test_bad_cursor_is_first_page(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(None))
+
+
+class QueryPlanCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(first_name='john', email='john@example.com')
+        self.u2 = User(first_name='susan', email='susan@example.com')
+        self.post = Post(post_details='post from susan', author=self.u2)
+        db.session.add_all([self.u1, self.u2, self.post])
+        db.session.commit()
+
+    def assertUsesIndexes(self, query):
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql)]
+        for table in ('followers', 'post_like', 'comment', 'post', 'user', 'event', 'user_to_event'):
+            for step in plan:
+                self.assertNotRegex(step, r'^SCAN (TABLE )?{}( |$)(?!.*USING)'.format(table), plan)
+        return plan
+
+    def test_hot_queries_use_indexes(self):
+        u1, u2, post = self.u1, self.u2, self.post
+        self.assertUsesIndexes(u1.followed.filter_by(id=u2.id))
+        self.assertUsesIndexes(u2.followers.filter_by(id=u1.id))
+        self.assertUsesIndexes(PostLike.query.filter(PostLike.user_id == u1.id, PostLike.post_id == post.id))
+        self.assertUsesIndexes(post.likes)
+        self.assertUsesIndexes(post.comments)
+        self.assertNotIn('USE TEMP B-TREE', ' '.join(self.assertUsesIndexes(post.get_comments())))
+        self.assertUsesIndexes(u2.posts.order_by(Post.timestamp.desc()))
+        self.assertUsesIndexes(u1.followed_posts())
+        self.assertUsesIndexes(Event.upcoming())
+        self.assertUsesIndexes(Event.upcoming('Brooklyn, NY'))
+        self.assertUsesIndexes(u1.calendar())
+        self.assertUsesIndexes(UserToEvent.query.filter_by(event_id=1))
+
+
+class ImageUploadCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dest = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest)
+        super().tearDown()
+
+    def test_stream_to_disk_enforces_size_on_stream(self):
+        path, hash = images.stream_to_disk(BytesIO(b'x' * 1000), self.dest, 1000)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 1000)
+        self.assertEqual(len(hash), 64)
+        with self.assertRaises(images.ImageTooLarge):
+            images.stream_to_disk(BytesIO(b'x' * 1001), self.dest, 1000)
+        self.assertEqual(os.listdir(self.dest), [os.path.basename(path)])
+
+    def test_oversized_body_is_refused(self):
+        limit = app.config['MAX_CONTENT_LENGTH']
+        self.assertGreater(limit, app.config['MAX_IMAGE_FILESIZE'])
+        with app.test_client() as client:
+            response = client.post('/login', data={'image': (BytesIO(b'x' * limit), 'big.jpg')})
+        self.assertEqual(response.status_code, 413)
+
+    @unittest.skipIf(PIL is None, 'Pillow is not installed')
+    def test_make_variants(self):
+        from PIL import Image
+        path = os.path.join(self.dest, 'cafe.png')
+        Image.new('RGB', (400, 200)).save(path, 'PNG')
+        written = images.make_variants(path, {'thumb': (100, 100)})
+        self.assertEqual(written, [os.path.join(self.dest, 'cafe_thumb.jpg')])
+        with Image.open(written[0]) as thumb:
+            self.assertEqual(thumb.size, (100, 50))
+
+
+class PhotoStoreCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dest = tempfile.mkdtemp()
+        self.upload_config = app.upload_set_config['photos']
+        app.upload_set_config['photos'] = UploadConfiguration(self.dest)
+        self.u1 = User(first_name='john', email='john@example.com')
+        self.u2 = User(first_name='susan', email='susan@example.com')
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+    def tearDown(self):
+        app.upload_set_config['photos'] = self.upload_config
+        shutil.rmtree(self.dest)
+        super().tearDown()
+
+    def test_duplicate_uploads_share_a_blob(self):
+        first, created = photo_store.save(FileStorage(BytesIO(b'cat'), 'cat.png'), self.u1, 1000)
+        self.assertTrue(created)
+        second, created = photo_store.save(FileStorage(BytesIO(b'cat'), 'copy.png'), self.u2, 1000)
+        self.assertFalse(created)
+        db.session.commit()
+        self.assertEqual(first.blob, second.blob)
+        self.assertEqual(PhotoBlob.query.count(), 1)
+        self.assertEqual(first.blob.photos.count(), 2)
+        hash = first.blob_hash
+        path = photo_store.path(hash, 'png')
+        self.assertEqual(os.path.relpath(path, self.dest), os.path.join(hash[:2], hash[2:4], hash + '.png'))
+        self.assertEqual([name for _, _, names in os.walk(self.dest) for name in names], [hash + '.png'])
+
+    def test_racing_uploads_share_a_blob(self):
+        hash = hashlib.sha256(b'cat').hexdigest()
+        # the other upload inserts the blob between the lookup and the insert
+        photo, created = racing_insert('INSERT OR IGNORE INTO photo_blob',
+                                       'INSERT INTO photo_blob (hash, extension, size) VALUES (?, ?, ?)',
+                                       (hash, 'jpg', 3),
+                                       lambda: photo_store.save(FileStorage(BytesIO(b'cat'), 'cat.png'), self.u1, 1000))
+        self.assertFalse(created)
+        db.session.commit()
+        self.assertEqual((photo.blob.hash, photo.blob.extension), (hash, 'jpg'))
+        self.assertEqual(PhotoBlob.query.count(), 1)
+        self.assertEqual([name for _, _, names in os.walk(self.dest) for name in names], [])
+
+    def test_photo_is_served_with_strong_etag(self):
+        photo, _ = photo_store.save(FileStorage(BytesIO(b'cat'), 'cat.png'), self.u1, 1000)
+        db.session.commit()
+        name = photo.blob_hash + '.png'
+        with app.test_client() as client:
+            response = client.get('/photos/' + name)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, b'cat')
+            self.assertEqual(response.headers['ETag'], '"{}"'.format(name))
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            response = client.get('/photos/' + name, headers={'If-None-Match': response.headers['ETag']})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(client.get('/photos/' + '0' * 64 + '.png').status_code, 404)
+            self.assertEqual(client.get('/photos/../app.db').status_code, 404)
+
+
+class SearchCase(AppTestCase):
+    config = {'SEARCH_BACKGROUND_REFRESH': False}
+
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(first_name='john', last_name='smith', email='john@example.com')
+        db.session.add(self.u1)
+        db.session.commit()
+        search_index.rebuild()
+
+    def test_ranking_and_prefix_match(self):
+        index = InvertedIndex()
+        index.add(('post', 1), 'lentil soup with lentils')
+        index.add(('post', 2), 'tomato soup')
+        index.add(('post', 3), 'lentil curry')
+        results = index.search('lentil soup')
+        self.assertEqual(results[0], ('post', 1))
+        self.assertEqual(set(results), {('post', 1), ('post', 2), ('post', 3)})
+        self.assertEqual(index.search('lentil soup', limit=1), [('post', 1)])
+        self.assertEqual(index.search('tom'), [('post', 2)])
+        index.remove(('post', 2))
+        self.assertEqual(index.search('tomato'), [])
+        self.assertNotIn('tomato', index.terms)
+
+    def test_commits_update_index(self):
+        post = Post(post_details='Smoky tofu scramble', author=self.u1)
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(search_index.search('tofu'), {'post': [post]})
+        self.assertEqual(search_index.search('smi'), {'user': [self.u1]})
+        post.post_details = 'Chickpea omelette'
+        db.session.commit()
+        self.assertEqual(search_index.search('tofu'), {})
+        self.assertEqual(search_index.search('chickpea'), {'post': [post]})
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(search_index.search('chickpea'), {})
+
+    def test_rolled_back_changes_are_not_indexed(self):
+        db.session.add(Post(post_details='Seitan roast', author=self.u1))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(search_index.search('seitan'), {})
+
+    def test_refresh_picks_up_bulk_inserts(self):
+        db.session.execute(Post.__table__.insert(), [{'post_details': 'Cashew cheese', 'user_id': self.u1.id}])
+        db.session.commit()
+        self.assertEqual(search_index.search('cashew'), {})
+        search_index.refresh()
+        self.assertEqual([p.post_details for p in search_index.search('cashew')['post']], ['Cashew cheese'])
+
+    def test_other_workers_catch_up_with_edits_and_deletes(self):
+        # a second SearchIndex stands in for another worker's, which the
+        # session hooks of this one never touch
+        kept, dropped = Post(post_details='Smoky tofu', author=self.u1), Post(post_details='Tofu curry', author=self.u1)
+        db.session.add_all([kept, dropped])
+        db.session.commit()
+        worker = SearchIndex()
+        worker.rebuild()
+        self.assertEqual(set(worker.index.search('tofu')), {('post', kept.id), ('post', dropped.id)})
+        kept.post_details = 'Chickpea omelette'
+        db.session.delete(dropped)
+        self.u1.first_name = 'jon'
+        db.session.commit()
+        self.assertEqual(len(worker.index.search('tofu')), 2)
+        worker.refresh()
+        self.assertEqual(worker.index.search('tofu'), [])
+        self.assertEqual(worker.index.search('chickpea'), [('post', kept.id)])
+        self.assertEqual(worker.index.search('jon'), [('user', self.u1.id)])
+        self.assertEqual(SearchTombstone.query.count(), 1)
+
+    def test_counter_updates_do_not_mark_rows_for_reindexing(self):
+        post = Post(post_details='Smoky tofu', author=self.u1)
+        db.session.add(post)
+        db.session.commit()
+        updated_at = post.updated_at
+        self.u1.like_post(post)
+        db.session.commit()
+        self.assertEqual(post.updated_at, updated_at)
+
+
+class NotificationCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False, 'NOTIFICATION_BACKGROUND_DELIVERY': False,
+              'EXPLORE_BACKGROUND_REFRESH': False, 'SUGGESTION_BACKGROUND_REFRESH': False}
+
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(first_name='john', email='john@example.com')
+        self.u2 = User(first_name='susan', email='susan@example.com')
+        self.u1.set_password('cat')
+        self.u2.set_password('dog')
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+        self.post = Post(post_details='hello', author=self.u2)
+        db.session.add(self.post)
+        db.session.commit()
+
+    def test_notifications_are_written_in_batches_after_commit(self):
+        notify(self.u2.id, self.u1.id, 'following')
+        notify(self.u1.id, self.u1.id, 'following')
+        db.session.rollback()
+        self.assertEqual(notification_queue.flush(), 0)
+        for _ in range(3):
+            notify(self.u2.id, self.u1.id, 'like post', self.post.id)
+        self.assertEqual(NotificationOutbox.query.count(), 0)
+        db.session.commit()
+        self.assertEqual((Notification.query.count(), NotificationOutbox.query.count()), (0, 3))
+        app.config['NOTIFICATION_BATCH_SIZE'] = 2
+        # per batch: read, claim by DELETE, insert, counter UPDATE; then one
+        # read that finds the outbox empty
+        self.assertEqual(count_queries(notification_queue.flush), 9)
+        self.assertEqual(NotificationOutbox.query.count(), 0)
+        self.assertEqual(Notification.query.filter_by(recipient_id=self.u2.id).count(), 3)
+        self.assertEqual(notification_queue.unread_count(self.u2.id), 3)
+        # the count comes from unread_cache; the one query is the inline
+        # delivery finding the outbox empty
+        self.assertEqual(count_queries(lambda: notification_queue.unread_count(self.u2.id)), 1)
+        newest = db.session.query(db.func.max(Notification.timestamp)).scalar()
+        notification_queue.mark_read(self.u2.id, newest)
+        db.session.commit()
+        self.assertEqual(notification_queue.unread_count(self.u2.id), 0)
+        self.assertEqual(User.query.get(self.u2.id).unread_notification_count, 0)
+        self.assertEqual(sum(reconcile_counters().values()), 0)
+
+    def test_first_visit_shows_what_it_marks_read(self):
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+            client.get('/like/{}/like'.format(self.post.id), headers={'Referer': '/index'})
+            client.get('/logout')
+            client.post('/login', data={'email': 'susan@example.com', 'password': 'dog'})
+            self.assertIn(b'liked your post', client.get('/notifications').data)
+            self.assertNotIn(b'class="badge"', client.get('/index').data)
+
+    def test_only_shown_notifications_are_marked_read(self):
+        notify(self.u2.id, self.u1.id, 'following')
+        db.session.commit()
+        notification_queue.flush()
+        shown = Notification.query.one().timestamp
+        notify(self.u2.id, self.u1.id, 'like post', self.post.id)
+        db.session.commit()
+        notification_queue.flush()
+        notification_queue.mark_read(self.u2.id, shown)
+        db.session.commit()
+        self.assertEqual(notification_queue.unread_count(self.u2.id), 1)
+        notification_queue.mark_read(self.u2.id, shown - timedelta(minutes=1))
+        db.session.commit()
+        self.assertEqual(User.query.get(self.u2.id).notifications_read_at, shown)
+
+    def test_batch_claimed_by_another_writer_is_skipped(self):
+        notify(self.u2.id, self.u1.id, 'following')
+        db.session.commit()
+        moved = racing_insert('DELETE FROM notification_outbox', 'DELETE FROM notification_outbox', (),
+                              lambda: notification_queue.deliver(10))
+        self.assertEqual(moved, 0)
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(User.query.get(self.u2.id).unread_notification_count, 0)
+
+    def test_interactions_notify_the_recipient(self):
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+            client.get('/follow/' + self.u2.username)
+            client.get('/like/{}/like'.format(self.post.id), headers={'Referer': '/index'})
+            client.get('/like/{}/like'.format(self.post.id), headers={'Referer': '/index'})
+            client.post('/post/{}/comment'.format(self.post.id), data={'body': 'nice'})
+            client.get('/logout')
+            client.post('/login', data={'email': 'susan@example.com', 'password': 'dog'})
+            self.assertIn(b'<span class="badge">3</span>', client.get('/index').data)
+            response = client.get('/notifications')
+            self.assertIn(b'started following you', response.data)
+            self.assertIn(b'liked your post', response.data)
+            self.assertIn(b'commented on your post', response.data)
+            self.assertNotIn(b'class="badge"', client.get('/index').data)
+
+    def test_notifications_are_cursor_paged(self):
+        now = datetime.utcnow()
+        db.session.execute(Notification.__table__.insert(), [
+            {'recipient_id': self.u2.id, 'sender_id': self.u1.id, 'type': 'following',
+             'timestamp': now - timedelta(minutes=i)} for i in range(30)])
+        db.session.commit()
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'susan@example.com', 'password': 'dog'})
+            response = client.get('/notifications')
+            self.assertEqual(response.data.count(b'started following you'), 25)
+            self.assertIn(b'/notifications?after=', response.data)
+            after = response.data.split(b'/notifications?after=')[1].split(b'"')[0].decode()
+            response = client.get('/notifications?after=' + after)
+            self.assertEqual(response.data.count(b'started following you'), 5)
+
+
+class EventCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(first_name='john', email='john@example.com')
+        self.u2 = User(first_name='susan', email='susan@example.com')
+        self.u1.set_password('cat')
+        now = datetime.utcnow()
+        self.past = Event(title='Past potluck', location='Brooklyn, NY', start_time_date=now - timedelta(days=1))
+        self.brooklyn = Event(title='Vegan Pop-Up', location='Brooklyn, NY', start_time_date=now + timedelta(days=2))
+        self.bronx = Event(title='Healthy Eating', location='Bronx,  NY', start_time_date=now + timedelta(days=1))
+        db.session.add_all([self.u1, self.u2, self.past, self.brooklyn, self.bronx])
+        db.session.commit()
+
+    def test_upcoming_by_location(self):
+        self.assertEqual(self.bronx.location_key, 'bronx ny')
+        upcoming = Event.upcoming().order_by(Event.start_time_date)
+        self.assertEqual(upcoming.all(), [self.bronx, self.brooklyn])
+        self.assertEqual(Event.upcoming('brooklyn').all(), [self.brooklyn])
+        self.assertEqual(Event.upcoming('BRONX, ny').all(), [self.bronx])
+        self.assertEqual(Event.upcoming('queens').all(), [])
+
+    def test_upcoming_is_cursor_paged_soonest_first(self):
+        def page(**kwargs):
+            return paginate_keyset(Event.upcoming(), 1, columns=(Event.start_time_date, Event.id),
+                                   key=lambda event: (event.start_time_date, event.id), oldest_first=True, **kwargs)
+        first = page()
+        self.assertEqual((first.items, first.has_prev), ([self.bronx], False))
+        second = page(after=first.next_cursor)
+        self.assertEqual((second.items, second.has_next), ([self.brooklyn], False))
+        self.assertEqual(page(before=second.prev_cursor).items, [self.bronx])
+
+    def test_rsvps_are_batched_and_counted(self):
+        pairs = [(self.u1.id, self.brooklyn.id), (self.u2.id, self.brooklyn.id), (self.u1.id, self.bronx.id)]
+        self.assertEqual(count_queries(lambda: interactions.rsvp_events(pairs + pairs)), 3)
+        db.session.commit()
+        self.assertEqual(interactions.rsvp_events(pairs), 0)
+        self.assertEqual((self.brooklyn.attendee_count, self.bronx.attendee_count), (2, 1))
+        self.assertEqual(interactions.cancel_rsvps([(self.u2.id, self.brooklyn.id), (self.u2.id, self.bronx.id)]), 1)
+        db.session.commit()
+        self.assertEqual((self.brooklyn.attendee_count, self.bronx.attendee_count), (1, 1))
+
+    def test_rsvps_count_only_inserted_rows(self):
+        pairs = [(self.u1.id, self.bronx.id), (self.u2.id, self.bronx.id)]
+        rsvped = racing_insert('INSERT OR IGNORE INTO user_to_event',
+                               'INSERT INTO user_to_event (user_id, event_id) VALUES (?, ?)', pairs[0],
+                               lambda: interactions.rsvp_events(pairs))
+        db.session.commit()
+        self.assertEqual(rsvped, 1)
+        self.assertEqual(self.bronx.attendee_count, 2)
+        self.assertEqual(sum(reconcile_counters().values()), 0)
+
+    def test_calendar_is_one_query(self):
+        interactions.rsvp_events([(self.u1.id, e.id) for e in (self.past, self.brooklyn, self.bronx)])
+        db.session.commit()
+        user = User.query.get(self.u1.id)
+        calendar = []
+        self.assertEqual(count_queries(lambda: calendar.extend(
+            (e.title, e.attendee_count) for e in user.calendar(since=datetime.utcnow()))), 1)
+        self.assertEqual(calendar, [('Healthy Eating', 1), ('Vegan Pop-Up', 1)])
+
+    def test_event_routes(self):
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+            response = client.post('/new_event', data={'name': 'Tofu workshop', 'location': 'Ithaca, NY',
+                                                       'date': (datetime.utcnow() + timedelta(days=3)).strftime(
+                                                           '%m/%d/%Y')})
+            self.assertEqual(response.status_code, 302)
+            event = Event.query.filter_by(title='Tofu workshop').one()
+            self.assertEqual((event.organizer, event.location_key), (self.u1.id, 'ithaca ny'))
+            self.assertIn(b'Tofu workshop', client.get('/events?location=ithaca').data)
+            self.assertNotIn(b'Vegan Pop-Up', client.get('/events?location=ithaca').data)
+            client.get('/event/{}/going'.format(event.id), headers={'Referer': '/events'})
+            self.assertIn(b'Tofu workshop', client.get('/calendar').data)
+            self.assertEqual(Event.query.get(event.id).attendee_count, 1)
+
+
+class SuggestionCase(AppTestCase):
+    config = {'SUGGESTION_BACKGROUND_REFRESH': False}
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User(first_name=name, email='{}@example.com'.format(name))
+                      for name in ('john', 'susan', 'mary', 'david', 'paula')]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def test_friends_of_friends_and_shared_events(self):
+        config = dict(app.config, SUGGESTIONS_PER_USER=2, SUGGESTION_MAX_EVENT_SIZE=2)
+        following = {1: array('l', [2, 3]), 2: array('l', [1, 4, 5]), 3: array('l', [4])}
+        attendees = {10: array('l', [1, 5]), 11: array('l', [1, 2, 3])}
+        suggestions = suggest(following, attendees, config)
+        # 4 is followed by both of 1's friends, 5 by one of them plus a shared
+        # event; event 11 is over the size limit
+        self.assertEqual(suggestions[1].tolist(), [4, 5])
+        self.assertEqual(suggestions[2].tolist(), [3])
+        self.assertNotIn(3, suggestions)
+
+    def test_suggestions_are_served_from_the_snapshot(self):
+        john, susan, mary, david, paula = self.users
+        interactions.follow_users([(john.id, susan.id), (susan.id, mary.id), (susan.id, david.id)])
+        event = Event(title='Potluck', location='Ithaca')
+        db.session.add(event)
+        db.session.commit()
+        interactions.rsvp_events([(john.id, event.id), (paula.id, event.id)])
+        db.session.commit()
+        self.assertEqual(suggested_users(john, 5), [mary, david, paula])
+        self.assertEqual(count_queries(lambda: suggestion_graph.suggested_ids(john.id)), 0)
+        john.follow(mary)
+        db.session.commit()
+        self.assertEqual(suggested_users(john, 5), [david, paula])
+        self.assertEqual(suggested_users(david, 5), [])
+
+    def test_follow_lists_are_paged_by_id(self):
+        john = self.users[0]
+        interactions.follow_users([(user.id, john.id) for user in self.users[1:]])
+        db.session.commit()
+        first = paginate_by_id(john.followers, followers.c.follower_id, 3)
+        self.assertEqual(first.items, self.users[1:4])
+        second = paginate_by_id(john.followers, followers.c.follower_id, 3, after=first.next_cursor)
+        self.assertEqual((second.items, second.has_next), (self.users[4:], False))
+        self.assertEqual(paginate_by_id(john.followers, followers.c.follower_id, 3, before=second.prev_cursor).items,
+                         self.users[1:4])
+        self.assertEqual(paginate_by_id(self.users[1].followed, followers.c.followed_id, 3).items, [john])
+
+
+class BenchmarkCase(AppTestCase):
+    config = {'EXPLORE_BACKGROUND_REFRESH': False, 'SUGGESTION_BACKGROUND_REFRESH': False,
+              'NOTIFICATION_BACKGROUND_DELIVERY': False}
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([bench_runner.percentile(values, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(bench_runner.percentile([7], 99), 7)
+
+    def test_generate_and_run(self):
+        with app.app_context():
+            size = bench_generate.generate(users=20, follows=3, posts=60, likes=200, comments=10, seed=3)
+            self.assertEqual((size['users'], size['posts'], size['comments']), (20, 60, 10))
+            self.assertEqual(sum(reconcile_counters().values()), 0)
+        results = bench_runner.run(app, requests=6, warmup=1)
+        self.assertEqual(set(results), set(bench_runner.ROUTES))
+        for stats in results.values():
+            self.assertEqual((stats['requests'], stats['errors']), (6, 0))
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+            self.assertGreater(stats['queries_per_request'], 0)
+        old = {'routes': results}
+        new = {'routes': dict(results, index=dict(results['index'], p95_ms=results['index']['p95_ms'] * 2))}
+        rows, regressions = bench_report.compare(old, new)
+        self.assertEqual([(route, metric) for route, metric, _, _, _ in regressions], [('index', 'p95_ms')])
+
+
+class InstrumentationCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        u = User(first_name='john', email='john@example.com')
+        u.set_password('cat')
+        db.session.add(u)
+        db.session.commit()
+        query_stats.clear()
+
+    def test_requests_are_measured(self):
+        with app.test_client() as client:
+            with self.assertLogs('app.requests', 'INFO') as logs:
+                response = client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+            self.assertRegex(response.headers['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", app;dur=[\d.]+$')
+            line = json.loads(logs.records[-1].getMessage())
+            self.assertEqual((line['endpoint'], line['status'], line['queries']), ('main.login', 302, 1))
+            self.assertEqual(client.get('/debug/queries').status_code, 404)
+            app.config['QUERY_DEBUG_ENDPOINT'] = True
+            report = client.get('/debug/queries').get_json()
+        login = [stats for stats in report if stats['endpoint'] == 'main.login'][0]
+        self.assertEqual((login['requests'], login['queries_per_request']), (1, 1))
+        self.assertTrue(login['slowest'][0]['statement'].startswith('SELECT user.id'))
+
+    def test_failed_statements_leave_no_timer(self):
+        with self.assertRaises(OperationalError):
+            db.session.execute('SELECT * FROM missing')
+        db.session.rollback()
+        self.assertFalse(db.session.connection().info.get('query_start'))
+        self.assertEqual(User.query.count(), 1)
+
+    def test_request_lines_are_written_out(self):
+        class LoggingConfig(TestConfig):
+            REQUEST_LOG = True
+
+        existing = list(request_logger.handlers)
+        other = create_app(LoggingConfig)
+        handler, = [handler for handler in request_logger.handlers if handler not in existing]
+        stream = StringIO()
+        handler.setStream(stream)
+        try:
+            with other.test_client() as client:
+                client.get('/login')
+        finally:
+            request_logger.removeHandler(handler)
+            request_logger.propagate = True
+        self.assertEqual(json.loads(stream.getvalue().splitlines()[-1])['endpoint'], 'main.login')
+
+
+class SeedCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        super().tearDown()
+
+    def write(self, name, content):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+    def indexes(self):
+        return sorted(name for name, in db.session.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+
+    def test_load_jsonl_and_csv(self):
+        self.write('users.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'id': 1, 'first_name': 'Mary', 'last_name': 'Jane', 'email': 'mary@example.com', 'password': 'cat'},
+            {'id': 2, 'first_name': 'Mary', 'last_name': 'Jane', 'email': 'mary2@example.com',
+             'dob': '1990-05-01T00:00:00'},
+            {'id': 3, 'username': 'Susan', 'first_name': 'Susan', 'email': 'susan@example.com'}]))
+        self.write('posts.csv', 'id,user_id,post_details,timestamp\n1,1,hello,2020-01-01T10:00:00\n2,3,hi,\n')
+        self.write('likes.csv', 'user_id,post_id\n2,1\n3,1\n2,1\n')
+        self.write('events.jsonl', json.dumps({'id': 1, 'title': 'Potluck', 'location': 'Ithaca, NY',
+                                               'start_time_date': '2030-01-01T18:00:00', 'organizer': 1}))
+        self.write('notes.txt', 'ignored')
+        indexes = self.indexes()
+        counts = seed.load(seed.find_sources([self.dir]), batch_size=2, hash_workers=0, drop_indexes=True)
+        self.assertEqual(counts, {'users': 3, 'events': 1, 'posts': 2, 'likes': 3})
+        self.assertEqual(self.indexes(), indexes)
+        users = User.query.order_by(User.id).all()
+        self.assertEqual([user.username for user in users], ['mary.jane', 'mary.jane2', 'susan'])
+        self.assertTrue(users[0].check_password('cat'))
+        self.assertEqual(users[1].dob, datetime(1990, 5, 1))
+        post = Post.query.get(1)
+        self.assertEqual((post.timestamp, post.like_count), (datetime(2020, 1, 1, 10), 2))
+        self.assertIsNotNone(Post.query.get(2).timestamp)
+        self.assertEqual(Event.query.get(1).location_key, 'ithaca ny')
+        self.assertEqual(sum(reconcile_counters().values()), 0)
+
+    def test_bad_input(self):
+        self.write('posts.jsonl', json.dumps({'id': 1, 'likes': 5}))
+        with self.assertRaises(ValueError):
+            seed.load(seed.find_sources([self.dir]), hash_workers=0)
+        with self.assertRaises(ValueError):
+            seed.find_sources([os.path.join(self.dir, 'posts.jsonl'), __file__])
+
+    def test_demo(self):
+        seed.load(seed.DEMO, hash_workers=0)
+        self.assertEqual(User.query.count(), 3)
+        self.assertTrue(User.query.filter_by(username='amber.elliott').one().check_password('123abc'))
+        self.assertEqual(Event.query.get(1).attendee_count, 2)
+        seed.reset()
+        self.assertEqual(User.query.count(), 0)
+
+
+class PasswordCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False}
+
+    def add_user(self, password_hash):
+        u = User(first_name='john', email='john@example.com', password_hash=password_hash)
+        db.session.add(u)
+        db.session.commit()
+        return u.id
+
+    def test_hash_parameters(self):
+        for workers in (0, 1):
+            app.config['PASSWORD_WORKERS'] = workers
+            password_hash = passwords.hash_password('cat')
+            self.assertTrue(password_hash.startswith(app.config['PASSWORD_HASH_METHOD'] + '$'))
+            self.assertFalse(passwords.needs_rehash(password_hash))
+            self.assertTrue(passwords.check_password(password_hash, 'cat'))
+            self.assertFalse(passwords.check_password(password_hash, 'dog'))
+        self.assertTrue(passwords.needs_rehash(passwords.hasher().func('cat', 'pbkdf2:sha256:1000')))
+        self.assertFalse(passwords.check_password(None, 'cat'))
+
+    def test_rehash_on_login(self):
+        old = passwords.hasher().func('cat', 'pbkdf2:sha256:1000')
+        user_id = self.add_user(old)
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'john@example.com', 'password': 'dog'})
+            self.assertEqual(User.query.get(user_id).password_hash, old)
+            response = client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.assertEqual(response.status_code, 302)
+        db.session.remove()
+        password_hash = User.query.get(user_id).password_hash
+        self.assertFalse(passwords.needs_rehash(password_hash))
+        self.assertTrue(User.query.get(user_id).check_password('cat'))
+
+    def test_busy_hasher(self):
+        self.add_user(passwords.hash_password('cat'))
+        app.config.update(PASSWORD_WORKERS=1, PASSWORD_QUEUE_LIMIT=0)
+        with app.test_client() as client:
+            response = client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], str(app.config['PASSWORD_RETRY_AFTER']))
+
+    def test_broken_pool_is_replaced(self):
+        app.config.update(PASSWORD_WORKERS=1, PASSWORD_QUEUE_LIMIT=1)
+        pool = passwords.get_pool()
+        # a worker dying breaks the executor for every later submit
+        with self.assertRaises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result()
+        with self.assertRaises(passwords.HasherBusy):
+            passwords.hash_password('cat')
+        self.assertEqual(passwords._pending, 0)
+        self.assertIsNot(passwords.get_pool(), pool)
+        self.assertTrue(passwords.check_password(passwords.hash_password('cat'), 'cat'))
+
+
+class ApiCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False, 'EXPLORE_BACKGROUND_REFRESH': False}
+
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(first_name='john', last_name='smith', email='john@example.com')
+        self.u2 = User(first_name='susan', last_name='jones', email='susan@example.com')
+        self.u1.set_password('cat')
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+        self.u1.follow(self.u2)
+        now = datetime.utcnow()
+        db.session.add_all([Post(post_details='post {}'.format(i), author=self.u2, timestamp=now + timedelta(seconds=i))
+                            for i in range(3)])
+        db.session.commit()
+        self.client = app.test_client()
+        self.client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+    def test_login_required(self):
+        response = app.test_client().get('/api/v1/feed')
+        self.assertEqual((response.status_code, response.get_json()), (401, {'error': 'login required'}))
+
+    def test_feed_records(self):
+        response = self.client.get('/api/v1/feed')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b' ', response.data.replace(b'post ', b''))
+        data = response.get_json()
+        self.assertEqual([post['text'] for post in data['posts']], ['post 2', 'post 1', 'post 0'])
+        self.assertEqual({key: data['posts'][0][key] for key in ('author', 'likes', 'comments', 'liked')},
+                         {'author': 'susan.jones', 'likes': 0, 'comments': 0, 'liked': False})
+        self.assertEqual((data['next'], data['prev']), (None, None))
+        self.assertEqual(len(self.client.get('/api/v1/explore').get_json()['posts']), 3)
+        self.assertEqual(self.client.get('/api/v1/user/nobody/posts').status_code, 404)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/v1/user/susan.jones/posts')
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        response = self.client.get('/api/v1/user/susan.jones/posts', headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data, response.headers['ETag']), (304, b'', etag))
+        # the user lookup and the page, nothing is serialized
+        self.assertIn('"2 queries"', response.headers['Server-Timing'])
+        self.u1.like_post(Post.query.filter_by(post_details='post 1').one())
+        db.session.commit()
+        response = self.client.get('/api/v1/user/susan.jones/posts', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual([post['liked'] for post in response.get_json()['posts']], [False, True, False])
+
+    def test_pages(self):
+        app.config['POSTS_PER_PAGE'] = 2
+        first = self.client.get('/api/v1/feed').get_json()
+        second = self.client.get(first['next']).get_json()
+        self.assertEqual([post['text'] for post in first['posts'] + second['posts']], ['post 2', 'post 1', 'post 0'])
+        self.assertIsNone(second['next'])
+        self.assertEqual([post['text'] for post in self.client.get(second['prev']).get_json()['posts']],
+                         ['post 2', 'post 1'])
+
+
+class ReplicaCase(AppTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.primary = os.path.join(self.dir, 'primary.db')
+        self.replica = os.path.join(self.dir, 'replica.db')
+        self.config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.primary, 'WTF_CSRF_ENABLED': False,
+                       'SUGGESTION_BACKGROUND_REFRESH': False}
+        super().setUp()
+        u = User(first_name='john', last_name='smith', email='john@example.com')
+        u.set_password('cat')
+        db.session.add(u)
+        db.session.add(Post(post_details='replicated', author=u))
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+        # the replica starts as a copy of the primary and is never updated
+        shutil.copy(self.primary, self.replica)
+        app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:///' + self.replica}
+        db.session.add(Post(post_details='primary only', author=User.query.get(1)))
+        db.session.commit()
+
+    def tearDown(self):
+        engines = [db.get_engine(app), db.get_engine(app, 'replica')]
+        super().tearDown()
+        for engine in engines:
+            engine.dispose()
+        shutil.rmtree(self.dir)
+
+    def test_sqlite_pragmas(self):
+        self.assertEqual(db.session.execute('PRAGMA journal_mode').scalar(), 'wal')
+        self.assertEqual(db.session.execute('PRAGMA synchronous').scalar(), 1)
+        self.assertEqual(db.session.execute('PRAGMA busy_timeout').scalar(), 5000)
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(Post.query.count(), 2)
+        with db.replica():
+            self.assertEqual(Post.query.count(), 1)
+            post = Post.query.one()
+            post.post_details = 'edited'
+            db.session.commit()
+        self.assertEqual(Post.query.get(post.id).post_details, 'edited')
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+            self.assertNotIn(b'primary only', client.get('/user/john.smith').data)
+            client.post('/index', data={'content': 'new post'})
+            # the author reads their own write from the primary ...
+            self.assertIn(b'new post', client.get('/index').data)
+            self.assertIn(b'primary only', client.get('/user/john.smith').data)
+            # ... until the sticky window is over
+            with client.session_transaction() as session:
+                session[PRIMARY_UNTIL] -= app.config['REPLICA_STICKY_SECONDS']
+            self.assertNotIn(b'new post', client.get('/index').data)
+            self.assertEqual(len(client.get('/api/v1/feed').get_json()['posts']), 1)
+        self.assertEqual(Post.query.filter_by(post_details='new post').count(), 1)
+
+    def test_reads_in_a_writing_transaction_stay_on_the_primary(self):
+        with db.replica():
+            self.assertEqual(Post.query.count(), 1)
+            db.session.add(Post(post_details='unflushed', author=User.query.get(1)))
+            self.assertEqual(Post.query.count(), 3)
+            db.session.rollback()
+            self.assertEqual(Post.query.count(), 1)
+
+
+class StreamingCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False, 'EXPLORE_BACKGROUND_REFRESH': False, 'SUGGESTION_BACKGROUND_REFRESH': False,
+              'POSTS_PER_PAGE': 3, 'FEED_STREAM_CHUNK': 2}
+
+    def setUp(self):
+        super().setUp()
+        u = User(first_name='john', last_name='smith', email='john@example.com')
+        u.set_password('cat')
+        now = datetime.utcnow()
+        db.session.add_all([u] + [Post(post_details='post {}'.format(i), author=u, timestamp=now + timedelta(seconds=i))
+                                  for i in range(7)])
+        db.session.commit()
+        self.client = app.test_client()
+        self.client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+
+    def pages(self, url):
+        bodies = []
+        while url:
+            body = self.client.get(url).get_data(as_text=True)
+            bodies.append(body)
+            url = None
+            for line in body.splitlines():
+                if 'after=' in line:
+                    url = line.strip()[len('<a href="'):-len('">')].replace('&amp;', '&')
+        return bodies
+
+    def test_streamed_pages_match_rendered_pages(self):
+        for url in ('/index', '/explore', '/user/john.smith'):
+            rendered = self.pages(url) if 'explore' not in url else [self.client.get(url).get_data(as_text=True)]
+            app.config['FEED_STREAMING'] = True
+            streamed = self.pages(url) if 'explore' not in url else [self.client.get(url).get_data(as_text=True)]
+            app.config['FEED_STREAMING'] = False
+            self.assertEqual(streamed, rendered)
+        self.assertEqual(len(rendered), 3)
+
+    def test_shell_is_sent_before_the_posts(self):
+        app.config['FEED_STREAMING'] = True
+        response = self.client.get('/index', buffered=False)
+        self.assertTrue(response.is_streamed)
+        parts = [part.decode() for part in response.response]
+        response.close()
+        form = [i for i, part in enumerate(parts) if '<form' in part][0]
+        posts = [i for i, part in enumerate(parts) if 'post 6' in part or 'post 4' in part]
+        self.assertLess(form, posts[0])
+        self.assertLess(posts[0], posts[1])
+        self.assertNotIn('post 3', ''.join(parts))
+
+
+class FactoryCase(AppTestCase):
+    def test_apps_are_independent(self):
+        class OtherConfig(TestConfig):
+            POSTS_PER_PAGE = 5
+            USER_CACHE_SIZE = 1
+
+        other = create_app(OtherConfig)
+        self.assertEqual((other.config['POSTS_PER_PAGE'], app.config['POSTS_PER_PAGE']), (5, 25))
+        # each app has its own caches and refreshers, sized from its own config
+        with app.app_context():
+            user_cache.set(1, {'username': 'john'})
+            feed = explore_feed._get_current_object()
+        with other.app_context():
+            self.assertIsNone(user_cache.get(1))
+            self.assertEqual(user_cache.backend.maxsize, 1)
+            self.assertIsNot(explore_feed._get_current_object(), feed)
+        with app.app_context():
+            self.assertEqual(user_cache.get(1), {'username': 'john'})
+            self.assertEqual(user_cache.backend.maxsize, TestConfig.USER_CACHE_SIZE)
+        self.assertNotIn('migrate', other.extensions)
+        with other.test_request_context():
+            self.assertEqual(url_for('main.index'), '/index')
+            self.assertEqual(url_for('api.home_feed'), '/api/v1/feed')
+        with other.app_context():
+            db.create_all()
+            db.session.add(User(first_name='john', email='john@example.com'))
+            db.session.commit()
+            self.assertEqual(other.test_client().get('/login').status_code, 200)
+            db.drop_all()
+
+    def test_boot_benchmark(self):
+        results = bench_boot.run(runs=1)
+        self.assertEqual(set(results), {'boot.import', 'boot.create_app', 'boot.first_request'})
+        self.assertTrue(all(stats['p50_ms'] > 0 for stats in results.values()))
+
+
+class CommentThreadCase(AppTestCase):
+    config = {'WTF_CSRF_ENABLED': False, 'COMMENTS_PER_PAGE': 3}
+
+    def setUp(self):
+        super().setUp()
+        self.u1 = User(first_name='john', last_name='smith', email='john@example.com')
+        self.u2 = User(first_name='susan', last_name='jones', email='susan@example.com')
+        self.u1.set_password('cat')
+        self.post = Post(post_details='hello', author=self.u2)
+        db.session.add_all([self.u1, self.u2, self.post])
+        db.session.commit()
+        now = datetime.utcnow()
+        for i in range(7):
+            comment = self.post.add_comment('comment {}'.format(i), [self.u1, self.u2][i % 2])
+            comment.timestamp = now + timedelta(seconds=i)
+        db.session.commit()
+
+    def test_get_comments(self):
+        self.assertEqual([c.body for c in self.post.get_comments().limit(2)], ['comment 6', 'comment 5'])
+        self.assertEqual(self.post.get_comments().first().author, self.u1)
+
+    def test_thread_pages(self):
+        with app.test_client() as client:
+            client.post('/login', data={'email': 'john@example.com', 'password': 'cat'})
+            data = client.get('/api/v1/post/{}/comments'.format(self.post.id)).get_json()
+            self.assertEqual([(c['text'], c['author']) for c in data['comments']],
+                             [('comment 6', 'john.smith'), ('comment 5', 'susan.jones'), ('comment 4', 'john.smith')])
+            texts = []
+            url = data['next']
+            while url:
+                data = client.get(url).get_json()
+                texts += [c['text'] for c in data['comments']]
+                url = data['next']
+            self.assertEqual(texts, ['comment 3', 'comment 2', 'comment 1', 'comment 0'])
+            page = client.get('/post/{}/comments'.format(self.post.id))
+            self.assertIn(b'Susan Jones', page.data.title())
+            self.assertIn(b'comment 4', page.data)
+            self.assertNotIn(b'comment 3', page.data)
+            # the post, then the page of comments joined to their authors
+            self.assertIn('"2 queries"', page.headers['Server-Timing'])
+            self.assertEqual(client.get('/post/999/comments').status_code, 404)
+
+    def test_inline_comments_show_their_authors(self):
+        posts = hydrate_posts([self.post], self.u1, 3)
+        self.assertEqual([c.author.first_name for c in posts[0].stats.comments], ['john', 'susan', 'john'])
+        version = self.post.version
+        self.u1.touch_posts()
+        db.session.commit()
+        self.assertEqual(Post.query.get(self.post.id).version, version + 1)
+
+    def test_only_renames_invalidate_fragments(self):
+        version = self.post.version
+        self.u1.user_details = 'Vegan'
+        db.session.commit()
+        self.assertEqual(Post.query.get(self.post.id).version, version)
+        self.u1.last_name = 'Smith'
+        db.session.commit()
+        self.assertEqual(Post.query.get(self.post.id).version, version + 1)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
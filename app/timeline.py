@@ -0,0 +1,87 @@
+from flask import current_app
+from sqlalchemy import exists, literal, select
+
+from app import db
+from app.models import Post, TimelineEntry, followers
+
+timeline = TimelineEntry.__table__
+
+
+def enabled():
+    return current_app.config['TIMELINE_MODE'] == 'push'
+
+
+def home_posts(user):
+    if not enabled():
+        return user.followed_posts()
+    return Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id).filter(
+        TimelineEntry.user_id == user.id).order_by(TimelineEntry.timestamp.desc())
+
+
+def home_keys():
+    # columns the home feed is ordered by, for keyset pagination
+    if not enabled():
+        return Post.timestamp, Post.id
+    return TimelineEntry.timestamp, TimelineEntry.post_id
+
+
+def _insert(rows):
+    # rows selects (user_id, post_id, timestamp); entries that already exist are skipped
+    existing = exists().where(timeline.c.user_id == rows.c.user_id).where(timeline.c.post_id == rows.c.post_id)
+    new_rows = select([rows.c.user_id, rows.c.post_id, rows.c.timestamp]).where(~existing)
+    db.session.execute(timeline.insert().from_select(['user_id', 'post_id', 'timestamp'], new_rows))
+
+
+def fan_out_post(post):
+    if not enabled():
+        return
+    db.session.flush()
+    audience = select([followers.c.follower_id.label('user_id')]).where(
+        followers.c.followed_id == post.user_id).union(select([literal(post.user_id).label('user_id')])).alias()
+    _insert(select([audience.c.user_id, literal(post.id).label('post_id'),
+                    literal(post.timestamp).label('timestamp')]).alias())
+
+
+def add_followed(follower, followed):
+    if not enabled():
+        return
+    db.session.flush()
+    post = Post.__table__
+    _insert(select([literal(follower.id).label('user_id'), post.c.id.label('post_id'), post.c.timestamp]).where(
+        post.c.user_id == followed.id).alias())
+
+
+def add_follows(pairs):
+    # bulk add_followed for (follower_id, followed_id) pairs already written to
+    # followers; the id filters may match older follows too, but their
+    # entries already exist and are skipped
+    if not enabled() or not pairs:
+        return
+    post = Post.__table__
+    _insert(select([followers.c.follower_id.label('user_id'), post.c.id.label('post_id'), post.c.timestamp]).where(
+        followers.c.followed_id == post.c.user_id).where(
+        followers.c.follower_id.in_({follower_id for follower_id, _ in pairs})).where(
+        followers.c.followed_id.in_({followed_id for _, followed_id in pairs})).alias())
+
+
+def remove_followed(follower, followed):
+    if not enabled():
+        return
+    db.session.flush()
+    post = Post.__table__
+    db.session.execute(timeline.delete().where(timeline.c.user_id == follower.id).where(
+        timeline.c.post_id.in_(select([post.c.id]).where(post.c.user_id == followed.id))))
+
+
+def rebuild(user_ids=None):
+    post = Post.__table__
+    delete = timeline.delete()
+    followed = select([followers.c.follower_id.label('user_id'), post.c.id.label('post_id'), post.c.timestamp]).where(
+        followers.c.followed_id == post.c.user_id)
+    own = select([post.c.user_id.label('user_id'), post.c.id.label('post_id'), post.c.timestamp])
+    if user_ids:
+        delete = delete.where(timeline.c.user_id.in_(user_ids))
+        followed = followed.where(followers.c.follower_id.in_(user_ids))
+        own = own.where(post.c.user_id.in_(user_ids))
+    db.session.execute(delete)
+    _insert(followed.union(own).alias())
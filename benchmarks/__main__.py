@@ -0,0 +1,110 @@
+# python -m benchmarks generate --database sqlite:////tmp/bench.db   (after flask db upgrade)
+# python -m benchmarks run --database sqlite:////tmp/bench.db
+# python -m benchmarks boot
+# python -m benchmarks compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+import sys
+
+import click
+
+from app import create_app
+from config import Config, engine_options
+from benchmarks import boot as boot_timer, generate as generator, report, runner
+
+
+def _app(database):
+    if not database:
+        return create_app()
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database
+        SQLALCHEMY_ENGINE_OPTIONS = engine_options(database)
+
+    return create_app(BenchmarkConfig)
+
+
+@click.group()
+def cli():
+    """Synthetic data and latency benchmarks for the main routes."""
+    pass
+
+
+@cli.command()
+@click.option('--database', help='Database URL, defaults to DATABASE_URL.')
+@click.option('--users', default=100000, show_default=True)
+@click.option('--follows', default=50, show_default=True, help='Average number of users each user follows.')
+@click.option('--follow-shape', type=click.Choice(['powerlaw', 'uniform']), default='powerlaw', show_default=True)
+@click.option('--follow-skew', default=1.0, show_default=True)
+@click.option('--posts', default=1000000, show_default=True)
+@click.option('--post-shape', type=click.Choice(['powerlaw', 'uniform']), default='powerlaw', show_default=True)
+@click.option('--post-skew', default=0.8, show_default=True)
+@click.option('--likes', default=3000000, show_default=True)
+@click.option('--like-shape', type=click.Choice(['powerlaw', 'uniform']), default='powerlaw', show_default=True)
+@click.option('--like-skew', default=1.0, show_default=True)
+@click.option('--comments', default=500000, show_default=True)
+@click.option('--days', default=365, show_default=True, help='Spread timestamps over this many days.')
+@click.option('--seed', default=1, show_default=True)
+def generate(database, **options):
+    """Append a synthetic data set; run against a fresh, migrated database."""
+    app = _app(database)
+    with app.app_context():
+        size = generator.generate(log=click.echo, **options)
+    click.echo(', '.join('{} {}'.format(count, name) for name, count in size.items()))
+
+
+@cli.command()
+@click.option('--database', help='Database URL, defaults to DATABASE_URL.')
+@click.option('--route', 'routes', type=click.Choice(runner.ROUTES), multiple=True,
+              help='Only run these routes, defaults to all.')
+@click.option('--requests', default=200, show_default=True, help='Timed requests per route.')
+@click.option('--warmup', default=20, show_default=True, help='Untimed requests per route.')
+@click.option('--concurrency', default=1, show_default=True, help='Concurrent logged in clients.')
+@click.option('--mode', type=click.Choice(['client', 'server']), default='client', show_default=True,
+              help='Flask test client in process, or HTTP against a local WSGI server.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--save/--no-save', default=True, show_default=True, help='Write the results to benchmarks/results.')
+def run(database, routes, save, **settings):
+    """Measure latency percentiles, queries per request and throughput."""
+    app = _app(database)
+    results = runner.run(app, routes=routes or runner.ROUTES, **settings)
+    for route, stats in results.items():
+        click.echo('{:<12} p50 {p50_ms}ms  p95 {p95_ms}ms  p99 {p99_ms}ms  {queries_per_request} queries  '
+                   '{throughput_rps} req/s  {errors} errors'.format(route, **stats))
+    if save:
+        with app.app_context():
+            dataset = generator.dataset_size()
+        settings.update({key: app.config[key] for key in ('TIMELINE_MODE', 'FEED_PAGINATION', 'POSTS_PER_PAGE')})
+        click.echo('Saved {}'.format(report.save(results, dataset, settings)))
+
+
+@cli.command()
+@click.option('--runs', default=20, show_default=True, help='Fresh interpreters to time.')
+@click.option('--save/--no-save', default=True, show_default=True, help='Write the results to benchmarks/results.')
+def boot(runs, save):
+    """Measure import, create_app and first request time of a new process."""
+    results = boot_timer.run(runs)
+    for phase, stats in results.items():
+        click.echo('{:<20} p50 {p50_ms}ms  p95 {p95_ms}ms  max {max_ms}ms'.format(phase, **stats))
+    if save:
+        click.echo('Saved {}'.format(report.save(results, {}, {'runs': runs})))
+
+
+@cli.command()
+@click.argument('old', type=click.Path(exists=True, dir_okay=False))
+@click.argument('new', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=10.0, show_default=True, help='Percent change that counts as a regression.')
+def compare(old, new, threshold):
+    """Compare two saved runs; exits with 1 when a metric regressed."""
+    old, new = report.load(old), report.load(new)
+    for key, name in (('dataset', 'data sets'), ('settings', 'settings')):
+        if old[key] != new[key]:
+            click.echo('Warning: the runs used different {}'.format(name), err=True)
+    rows, regressions = report.compare(old, new, threshold)
+    click.echo(report.format_table(rows))
+    if regressions:
+        click.echo('\n{} regressions over {}%:'.format(len(regressions), threshold))
+        click.echo(report.format_table(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
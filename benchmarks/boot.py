@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.runner import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ('import', 'create_app', 'first_request')
+
+# Runs in a fresh interpreter for every sample, so nothing is imported or
+# compiled yet: importing the app package, building an app with create_app
+# and serving its first request (which compiles the login templates).
+SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+flask_app.test_client().get('/login')
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported, 'first_request': done - created}))
+'''
+
+
+def sample():
+    # the request log line would only clutter the benchmark's own output
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=ROOT, env=dict(os.environ, REQUEST_LOG='off'))
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(runs=20):
+    # {'boot.<phase>': stats}, in the same shape as the route results so
+    # saved runs can be compared with the compare command
+    samples = [sample() for _ in range(runs)]
+    return {'boot.' + phase: summarize([s[phase] for s in samples], [], 0, None) for phase in PHASES}
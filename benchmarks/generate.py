@@ -0,0 +1,115 @@
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from app import db, passwords, timeline
+from app.interactions import insert_ignore
+from app.models import Comment, Post, PostLike, User, followers, reconcile_counters
+
+# every generated user logs in with this password
+PASSWORD = 'bench'
+CHUNK = 10000
+WORDS = ('tofu', 'tempeh', 'seitan', 'lentil', 'chickpea', 'kale', 'oat', 'cashew', 'curry', 'soup', 'salad',
+         'market', 'recipe', 'brunch', 'potluck', 'spicy', 'smoky', 'fresh', 'roasted', 'vegan')
+
+
+class Picker(object):
+    # Draws ids either uniformly or with a power law over a shuffled order,
+    # where the id at popularity rank r is drawn with weight 1 / r ** skew.
+
+    def __init__(self, rng, ids, shape='powerlaw', skew=1.0):
+        self.rng = rng
+        self.ids = list(ids)
+        rng.shuffle(self.ids)
+        self.cum_weights = None
+        if shape == 'powerlaw':
+            self.cum_weights = list(accumulate(1.0 / rank ** skew for rank in range(1, len(self.ids) + 1)))
+        elif shape != 'uniform':
+            raise ValueError('Unknown shape {!r}'.format(shape))
+
+    def pick(self, k):
+        if self.cum_weights is None:
+            return self.rng.choices(self.ids, k=k)
+        return self.rng.choices(self.ids, cum_weights=self.cum_weights, k=k)
+
+
+def _insert(table, rows, ignore=False):
+    for start in range(0, len(rows), CHUNK):
+        if ignore:
+            insert_ignore(table, rows[start:start + CHUNK])
+        else:
+            db.session.execute(table.insert(), rows[start:start + CHUNK])
+        db.session.commit()
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def generate(users=1000, follows=20, follow_shape='powerlaw', follow_skew=1.0, posts=10000, post_shape='powerlaw',
+             post_skew=0.8, likes=50000, like_shape='powerlaw', like_skew=1.0, comments=5000, days=90, seed=1,
+             log=lambda message: None):
+    # Appends a synthetic data set to the configured database with Core
+    # executemany in chunks, then recomputes the counters (and the push
+    # timelines when TIMELINE_MODE is 'push'). follows is the average number
+    # of users each user follows; who gets followed, who posts and which
+    # posts get liked or commented on follow the given shapes.
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+
+    def timestamp():
+        return now - timedelta(seconds=rng.uniform(0, days * 86400))
+
+    first = _next_id(User)
+    user_ids = range(first, first + users)
+    password_hash = passwords.hasher()(PASSWORD)
+    _insert(User.__table__, [{'id': id, 'username': 'bench{}'.format(id), 'email': 'bench{}@example.com'.format(id),
+                              'first_name': 'Bench', 'last_name': str(id), 'password_hash': password_hash,
+                              'dob': datetime(1990, 1, 1)} for id in user_ids])
+    log('{} users'.format(users))
+
+    followed = Picker(rng, user_ids, follow_shape, follow_skew)
+    edges = []
+    for follower_id in user_ids:
+        targets = set(followed.pick(rng.randint(0, 2 * follows))) if follows else set()
+        targets.discard(follower_id)
+        edges.extend({'follower_id': follower_id, 'followed_id': followed_id} for followed_id in targets)
+    _insert(followers, edges)
+    log('{} follows'.format(len(edges)))
+
+    first = _next_id(Post)
+    post_ids = range(first, first + posts)
+    authors = Picker(rng, user_ids, post_shape, post_skew).pick(posts)
+    _insert(Post.__table__, [{'id': id, 'user_id': user_id, 'post_details': _sentence(rng, 8), 'timestamp': timestamp()}
+                             for id, user_id in zip(post_ids, authors)])
+    log('{} posts'.format(posts))
+
+    liked = Picker(rng, post_ids, like_shape, like_skew)
+    for start in range(0, likes, CHUNK):
+        size = min(CHUNK, likes - start)
+        _insert(PostLike.__table__, [{'user_id': user_id, 'post_id': post_id, 'timestamp': timestamp()}
+                                     for user_id, post_id in zip(rng.choices(user_ids, k=size), liked.pick(size))],
+                ignore=True)
+    log('{} likes drawn, duplicates skipped'.format(likes))
+
+    _insert(Comment.__table__, [{'post_id': post_id, 'user_id': rng.choice(user_ids), 'body': _sentence(rng, 5),
+                                 'timestamp': timestamp()} for post_id in liked.pick(comments)])
+    log('{} comments'.format(comments))
+
+    reconcile_counters()
+    db.session.commit()
+    if timeline.enabled():
+        timeline.rebuild()
+        db.session.commit()
+    log('counters{} rebuilt'.format(' and timelines' if timeline.enabled() else ''))
+    return dataset_size()
+
+
+def dataset_size():
+    return {name: db.session.query(db.func.count()).select_from(table).scalar()
+            for name, table in (('users', User.__table__), ('follows', followers), ('posts', Post.__table__),
+                                ('likes', PostLike.__table__), ('comments', Comment.__table__))}
@@ -0,0 +1,67 @@
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# compared metrics, and whether a higher value is better
+METRICS = (('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('queries_per_request', False),
+           ('throughput_rps', True))
+
+
+def _git(*args):
+    try:
+        return subprocess.check_output(('git',) + args, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(routes, dataset, settings, directory=RESULTS_DIR):
+    # one JSON file per run, named after the time and commit it measured
+    commit = _git('rev-parse', '--short', 'HEAD') or 'unknown'
+    now = datetime.utcnow()
+    result = {
+        'commit': commit,
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': now.isoformat(),
+        'python': platform.python_version(),
+        'dataset': dataset,
+        'settings': settings,
+        'routes': routes,
+    }
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{}-{}.json'.format(now.strftime('%Y%m%dT%H%M%S'), commit))
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    return path
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new, threshold=10.0):
+    # returns (rows, regressions); a metric regresses when it is more than
+    # threshold percent worse than in the old run
+    rows, regressions = [], []
+    for route in sorted(set(old['routes']) & set(new['routes'])):
+        for metric, higher_is_better in METRICS:
+            before, after = old['routes'][route].get(metric), new['routes'][route].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            row = (route, metric, before, after, change)
+            rows.append(row)
+            if worse > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def format_table(rows):
+    lines = ['{:<12} {:<20} {:>12} {:>12} {:>9}'.format('route', 'metric', 'old', 'new', 'change')]
+    for route, metric, before, after, change in rows:
+        lines.append('{:<12} {:<20} {:>12} {:>12} {:>+8.1f}%'.format(route, metric, before, after, change))
+    return '\n'.join(lines)
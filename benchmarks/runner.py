@@ -0,0 +1,208 @@
+import http.client
+import logging
+import math
+import random
+import threading
+import time
+from urllib.parse import urlencode
+
+from flask import g
+from werkzeug.serving import make_server
+
+from app import db
+from app.models import Post, User
+from benchmarks.generate import PASSWORD
+
+ROUTES = ('index', 'explore', 'user', 'like_action', 'login')
+ANONYMOUS_ROUTES = ('login',)
+QUERY_HEADER = 'X-Bench-Queries'
+
+
+def instrument(app):
+    # passes on the query count app.instrumentation records for each request
+    # in a response header, so both runners see it
+    app.config['INSTRUMENTATION'] = True
+    if app.extensions.get('bench_instrumented'):
+        return
+    app.extensions['bench_instrumented'] = True
+
+    def add_query_header(response):
+        response.headers[QUERY_HEADER] = str(g.get('query_count', 0))
+        return response
+
+    app.after_request(add_query_header)
+
+
+class TestClient(object):
+    # drives the app in process through Flask's test client
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, headers=None):
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        response.close()
+        return response.status_code, int(response.headers.get(QUERY_HEADER, 0))
+
+
+class HTTPClient(object):
+    # drives a local WSGI server over HTTP, keeping the session cookie and
+    # never following redirects
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.cookies = {}
+
+    def request(self, method, path, data=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join('{}={}'.format(*item) for item in self.cookies.items())
+        connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            for cookie in response.headers.get_all('Set-Cookie') or ():
+                name, _, value = cookie.split(';', 1)[0].partition('=')
+                self.cookies[name.strip()] = value
+            return response.status, int(response.getheader(QUERY_HEADER) or 0)
+        finally:
+            connection.close()
+
+
+class LocalServer(object):
+    def __init__(self, app):
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='bench-server', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+
+    def client(self):
+        return HTTPClient('127.0.0.1', self.server.server_port)
+
+
+def percentile(values, p):
+    # nearest rank on sorted values
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max_ms': ms(latencies[-1]) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+class Workload(object):
+    # picks the request for each route from the ids that are in the database
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.user_ids = [id for id, in db.session.query(User.id).filter(User.email.like('bench%@example.com'))]
+        self.post_ids = [id for id, in db.session.query(Post.id)]
+        if not self.user_ids or not self.post_ids:
+            raise RuntimeError('No benchmark data, run "python -m benchmarks generate" first')
+        db.session.remove()
+
+    def credentials(self):
+        return {'email': 'bench{}@example.com'.format(self.rng.choice(self.user_ids)), 'password': PASSWORD}
+
+    def request(self, route):
+        if route == 'index':
+            return 'GET', '/index', None, None
+        if route == 'explore':
+            return 'GET', '/explore', None, None
+        if route == 'user':
+            return 'GET', '/user/bench{}'.format(self.rng.choice(self.user_ids)), None, None
+        if route == 'like_action':
+            return 'GET', '/like/{}/like'.format(self.rng.choice(self.post_ids)), None, {'Referer': '/index'}
+        if route == 'login':
+            return 'POST', '/login', self.credentials(), None
+        raise ValueError('Unknown route {!r}'.format(route))
+
+
+def run(app, routes=ROUTES, requests=200, warmup=20, concurrency=1, mode='client', seed=1):
+    # Runs every route in turn: warmup requests first, then requests timed
+    # ones spread over concurrency logged in clients. Returns per route
+    # latency percentiles, queries per request and throughput.
+    app.config['WTF_CSRF_ENABLED'] = False
+    instrument(app)
+    with app.app_context():
+        workload = Workload(seed)
+    if mode == 'server':
+        server = LocalServer(app)
+        make_client = server.client
+    elif mode == 'client':
+        server = None
+        make_client = lambda: TestClient(app)
+    else:
+        raise ValueError('Unknown mode {!r}'.format(mode))
+    if server is not None:
+        server.__enter__()
+    try:
+        clients = []
+        for _ in range(concurrency):
+            client = make_client()
+            client.request('POST', '/login', workload.credentials())
+            clients.append(client)
+        results = {}
+        for route in routes:
+            # login is measured from logged out clients, one per request
+            fresh = make_client if route in ANONYMOUS_ROUTES else None
+            for _ in range(warmup):
+                (fresh() if fresh else clients[0]).request(*workload.request(route))
+            results[route] = _measure(clients, workload, route, requests, fresh)
+        return results
+    finally:
+        if server is not None:
+            server.__exit__(None, None, None)
+
+
+def _measure(clients, workload, route, requests, fresh=None):
+    latencies, queries, errors = [], [], [0]
+    lock = threading.Lock()
+    # the requests are drawn up front so every client thread only times
+    plan = [workload.request(route) for _ in range(requests)]
+    shares = [plan[i::len(clients)] for i in range(len(clients))]
+
+    def work(client, share):
+        for request in share:
+            if fresh is not None:
+                client = fresh()
+            start = time.perf_counter()
+            status, count = client.request(*request)
+            duration = time.perf_counter() - start
+            with lock:
+                latencies.append(duration)
+                queries.append(count)
+                if status >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=work, args=(client, share)) for client, share in zip(clients, shares)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, queries, errors[0], time.perf_counter() - start)
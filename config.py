@@ -3,9 +3,110 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def engine_options(database_uri):
+    # pool settings for server databases, SQLite keeps Flask-SQLAlchemy's defaults
+    return {} if database_uri.startswith('sqlite') else {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW') or 20),
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE') or 1800),
+        'pool_pre_ping': True,
+    }
+
+
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'secret_key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # optional read replica; SELECTs inside db.replica() go there
+    SQLALCHEMY_BINDS = {'replica': os.environ['REPLICA_DATABASE_URL']} if os.environ.get('REPLICA_DATABASE_URL') \
+        else {}
+    # after committing a write a user reads from the primary for this many
+    # seconds; set it above the replica's usual lag
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 5)
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # run on every new SQLite connection: WAL lets readers carry on during a
+    # write, NORMAL only syncs at checkpoints, busy_timeout (ms) waits for the
+    # write lock instead of failing with "database is locked"
+    SQLITE_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000}
     UPLOADED_PHOTOS_DEST = os.path.join(basedir, 'uploads')
+    ALLOWED_IMAGE_EXTENSIONS = ['JPEG', 'JPG', 'PNG', 'GIF']
+    MAX_IMAGE_FILESIZE = 512 * 1024
+    # whole request bodies past this are refused with a 413 before werkzeug
+    # spools them; the slack covers the multipart framing and other fields
+    MAX_CONTENT_LENGTH = MAX_IMAGE_FILESIZE + 64 * 1024
+    # resized copies made for every upload, as name: (max width, max height)
+    IMAGE_VARIANTS = {'thumb': (150, 150), 'medium': (800, 800)}
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS') or 2)
+    # werkzeug method string; stored hashes with another method or salt length
+    # are upgraded on the next login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 8
+    # hashing runs in this many processes, 0 hashes in the request thread;
+    # beyond PASSWORD_QUEUE_LIMIT waiting or running hashes requests get a 503
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS') or 2)
+    PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT') or 32)
+    PASSWORD_TIMEOUT = 10
+    # seconds sent in Retry-After with that 503
+    PASSWORD_RETRY_AFTER = 5
     POSTS_PER_PAGE = 25
+    # 'cursor' pages feeds by (timestamp, id) keyset, 'offset' uses page numbers
+    FEED_PAGINATION = os.environ.get('FEED_PAGINATION') or 'cursor'
+    COMMENTS_PER_POST = 3
+    COMMENTS_PER_PAGE = 50
+    # send feed pages as they render, posts read FEED_STREAM_CHUNK rows at a
+    # time; FEED_STREAM_BUFFER template parts are sent together
+    FEED_STREAMING = os.environ.get('FEED_STREAMING') == 'on'
+    FEED_STREAM_CHUNK = 10
+    FEED_STREAM_BUFFER = 5
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 5000)
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL') or 3600)
+    # explore is ranked in the background at most once per interval (seconds)
+    EXPLORE_REFRESH_INTERVAL = int(os.environ.get('EXPLORE_REFRESH_INTERVAL') or 60)
+    EXPLORE_BACKGROUND_REFRESH = True
+    EXPLORE_CANDIDATES = 1000
+    EXPLORE_ACTIVITY_WINDOW = 48
+    EXPLORE_GRAVITY = 1.5
+    # who-to-follow suggestions are recomputed in the background at most once
+    # per interval (seconds)
+    SUGGESTION_REFRESH_INTERVAL = int(os.environ.get('SUGGESTION_REFRESH_INTERVAL') or 300)
+    SUGGESTION_BACKGROUND_REFRESH = True
+    SUGGESTIONS_PER_USER = 10
+    SUGGESTION_EVENT_WEIGHT = 1
+    SUGGESTION_MAX_EVENT_SIZE = 200
+    SUGGESTIONS_SHOWN = 5
+    FOLLOWS_PER_PAGE = 50
+    # how often (seconds) search catches up with rows written by other
+    # processes, how far back each catch-up looks again, and how often the
+    # index is rebuilt from scratch
+    SEARCH_REFRESH_INTERVAL = int(os.environ.get('SEARCH_REFRESH_INTERVAL') or 30)
+    SEARCH_CATCH_UP_OVERLAP = 60
+    SEARCH_REBUILD_INTERVAL = int(os.environ.get('SEARCH_REBUILD_INTERVAL') or 3600)
+    SEARCH_BACKGROUND_REFRESH = True
+    SEARCH_RESULTS = 50
+    # per request query counts and timings: Server-Timing headers, one JSON log
+    # line per request and per endpoint totals, served at /debug/queries when
+    # QUERY_DEBUG_ENDPOINT is set
+    INSTRUMENTATION = (os.environ.get('INSTRUMENTATION') or 'on') != 'off'
+    # where the JSON lines go: stderr unless the app.requests logger already
+    # has a handler, or nowhere with REQUEST_LOG=off
+    REQUEST_LOG = (os.environ.get('REQUEST_LOG') or 'on') != 'off'
+    QUERY_DEBUG_ENDPOINT = bool(os.environ.get('QUERY_DEBUG_ENDPOINT'))
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 100)
+    SLOWEST_QUERIES_KEPT = 5
+    # notifications are moved from the outbox by a background thread in
+    # batches of up to NOTIFICATION_BATCH_SIZE, at most
+    # NOTIFICATION_FLUSH_INTERVAL seconds late; the outbox is also polled
+    # every NOTIFICATION_POLL_INTERVAL seconds for rows other processes left
+    NOTIFICATION_BACKGROUND_DELIVERY = True
+    NOTIFICATION_BATCH_SIZE = 500
+    NOTIFICATION_FLUSH_INTERVAL = 1.0
+    NOTIFICATION_POLL_INTERVAL = 30
+    NOTIFICATIONS_PER_PAGE = 25
+    EVENTS_PER_PAGE = 25
+    UNREAD_CACHE_SIZE = int(os.environ.get('UNREAD_CACHE_SIZE') or 10000)
+    UNREAD_CACHE_TTL = int(os.environ.get('UNREAD_CACHE_TTL') or 60)
+    # 'pull' runs the followed_posts() query on every request, 'push' reads the
+    # materialized timeline_entry table filled on write.
+    TIMELINE_MODE = os.environ.get('TIMELINE_MODE') or 'pull'
@@ -0,0 +1,43 @@
+"""event location key and attendee count
+
+Revision ID: 3b8d2f6c1a70
+Revises: 7c1e5a9d3f42
+Create Date: 2026-10-18 14:21:05.882160
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8d2f6c1a70'
+down_revision = '7c1e5a9d3f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('event', sa.Column('attendee_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('event', sa.Column('location_key', sa.String(length=120), nullable=True))
+    op.create_index('ix_event_location_key_start_time_date', 'event', ['location_key', 'start_time_date'],
+                    unique=False)
+    op.create_index('ix_user_to_event_event_id', 'user_to_event', ['event_id'], unique=False)
+
+    op.execute('UPDATE event SET attendee_count = '
+               '(SELECT COUNT(*) FROM user_to_event WHERE user_to_event.event_id = event.id)')
+    # same normalization as app.models.location_key
+    connection = op.get_bind()
+    events = connection.execute(sa.text('SELECT id, location FROM event WHERE location IS NOT NULL')).fetchall()
+    for id, location in events:
+        connection.execute(sa.text('UPDATE event SET location_key = :key WHERE id = :id'),
+                           key=re.sub(r'[^a-z0-9]+', ' ', location.lower()).strip(), id=id)
+
+
+def downgrade():
+    op.drop_index('ix_user_to_event_event_id', table_name='user_to_event')
+    op.drop_index('ix_event_location_key_start_time_date', table_name='event')
+    with op.batch_alter_table('event') as batch_op:
+        batch_op.drop_column('location_key')
+        batch_op.drop_column('attendee_count')
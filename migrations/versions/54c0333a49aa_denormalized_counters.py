@@ -0,0 +1,39 @@
+"""denormalized like, comment and follower counters
+
+Revision ID: 54c0333a49aa
+Revises: fb89da8b96bf
+Create Date: 2026-10-18 10:41:52.117305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '54c0333a49aa'
+down_revision = 'fb89da8b96bf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('post', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('followed_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute('UPDATE post SET like_count = (SELECT COUNT(*) FROM post_like WHERE post_like.post_id = post.id)')
+    op.execute('UPDATE post SET comment_count = (SELECT COUNT(*) FROM comment WHERE comment.post_id = post.id)')
+    op.execute('UPDATE "user" SET follower_count = '
+               '(SELECT COUNT(*) FROM followers WHERE followers.followed_id = "user".id)')
+    op.execute('UPDATE "user" SET followed_count = '
+               '(SELECT COUNT(*) FROM followers WHERE followers.follower_id = "user".id)')
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('follower_count')
+        batch_op.drop_column('followed_count')
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('like_count')
+        batch_op.drop_column('comment_count')
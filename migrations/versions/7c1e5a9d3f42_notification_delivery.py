@@ -0,0 +1,33 @@
+"""notification post, recipient index and unread counter
+
+Revision ID: 7c1e5a9d3f42
+Revises: e277267b32bb
+Create Date: 2026-10-18 13:48:27.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5a9d3f42'
+down_revision = 'e277267b32bb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.add_column(sa.Column('post_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_notification_post_id_post', 'post', ['post_id'], ['id'])
+        batch_op.create_index('ix_notification_recipient_id_timestamp', ['recipient_id', 'timestamp'], unique=False)
+    op.add_column('user', sa.Column('unread_notification_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('unread_notification_count')
+    with op.batch_alter_table('notification') as batch_op:
+        batch_op.drop_index('ix_notification_recipient_id_timestamp')
+        batch_op.drop_constraint('fk_notification_post_id_post', type_='foreignkey')
+        batch_op.drop_column('post_id')
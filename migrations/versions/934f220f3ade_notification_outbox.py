@@ -0,0 +1,32 @@
+"""notification outbox
+
+Revision ID: 934f220f3ade
+Revises: d9602136b3e8
+Create Date: 2026-10-18 11:45:20.520924
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '934f220f3ade'
+down_revision = 'd9602136b3e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient_id', sa.Integer(), nullable=True),
+    sa.Column('sender_id', sa.Integer(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('type', sa.String(length=64), nullable=True),
+    sa.Column('post_id', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('notification_outbox')
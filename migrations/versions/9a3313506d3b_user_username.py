@@ -0,0 +1,45 @@
+"""unique username handle on user
+
+Revision ID: 9a3313506d3b
+Revises: 54c0333a49aa
+Create Date: 2026-10-18 11:26:05.730412
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3313506d3b'
+down_revision = '54c0333a49aa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('username', sa.String(length=64), nullable=True))
+
+    # backfill with the same scheme User.make_unique_username uses
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('first_name', sa.String),
+                    sa.column('last_name', sa.String), sa.column('username', sa.String))
+    connection = op.get_bind()
+    taken = set()
+    for id, first_name, last_name in connection.execute(
+            sa.select([user.c.id, user.c.first_name, user.c.last_name]).order_by(user.c.id)).fetchall():
+        base = re.sub(r'[^a-z0-9]+', '.', ' '.join(filter(None, [first_name, last_name])).lower()).strip('.')[:60]
+        username, suffix = base or 'user', 1
+        while username in taken:
+            suffix += 1
+            username = '{}{}'.format(base or 'user', suffix)
+        taken.add(username)
+        connection.execute(user.update().where(user.c.id == id).values(username=username))
+
+    op.create_index(op.f('ix_user_username'), 'user', ['username'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_username'), table_name='user')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('username')
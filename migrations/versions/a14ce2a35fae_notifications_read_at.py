@@ -0,0 +1,30 @@
+"""notifications read at
+
+Revision ID: a14ce2a35fae
+Revises: 934f220f3ade
+Create Date: 2026-10-18 11:57:50.587570
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a14ce2a35fae'
+down_revision = '934f220f3ade'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('notifications_read_at', sa.DateTime(), nullable=True))
+    # users with nothing unread have read everything they were sent, so
+    # reconcile_counters leaves their counter at 0
+    op.execute('UPDATE "user" SET notifications_read_at = '
+               '(SELECT MAX(timestamp) FROM notification WHERE notification.recipient_id = "user".id) '
+               'WHERE unread_notification_count = 0')
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('notifications_read_at')
@@ -0,0 +1,34 @@
+"""comment author and (post_id, timestamp) thread index
+
+Revision ID: d4a7c2e9b815
+Revises: 3b8d2f6c1a70
+Create Date: 2026-10-18 17:12:41.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c2e9b815'
+down_revision = '3b8d2f6c1a70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_comment_user_id_user', 'user', ['user_id'], ['id'])
+        batch_op.create_index('ix_comment_user_id', ['user_id'], unique=False)
+        batch_op.drop_index('ix_comment_post_id')
+        batch_op.create_index('ix_comment_post_id_timestamp', ['post_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_index('ix_comment_post_id_timestamp')
+        batch_op.create_index('ix_comment_post_id', ['post_id'], unique=False)
+        batch_op.drop_index('ix_comment_user_id')
+        batch_op.drop_constraint('fk_comment_user_id_user', type_='foreignkey')
+        batch_op.drop_column('user_id')
@@ -0,0 +1,43 @@
+"""updated_at on searchable tables and search tombstones
+
+Revision ID: d9602136b3e8
+Revises: d4a7c2e9b815
+Create Date: 2026-10-18 11:42:24.882313
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9602136b3e8'
+down_revision = 'd4a7c2e9b815'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ['comment', 'event', 'post', 'user']
+
+
+def upgrade():
+    op.create_table('search_tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=True),
+    sa.Column('doc_id', sa.Integer(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_search_tombstone_deleted_at'), 'search_tombstone', ['deleted_at'], unique=False)
+    # existing rows stay NULL; the first full build of each index reads them
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(op.f('ix_{}_updated_at'.format(table)))
+            batch_op.drop_column('updated_at')
+    op.drop_index(op.f('ix_search_tombstone_deleted_at'), table_name='search_tombstone')
+    op.drop_table('search_tombstone')
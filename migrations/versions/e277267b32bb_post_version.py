@@ -0,0 +1,25 @@
+"""post version for fragment cache keys
+
+Revision ID: e277267b32bb
+Revises: 4ef57048fc9c
+Create Date: 2026-10-18 13:02:11.406285
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e277267b32bb'
+down_revision = '4ef57048fc9c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('version')
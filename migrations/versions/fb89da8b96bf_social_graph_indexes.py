@@ -0,0 +1,55 @@
+"""primary key on followers, indexes for likes, comments and posts
+
+Revision ID: fb89da8b96bf
+Revises: 0fe59c9800dc
+Create Date: 2026-10-18 10:03:17.554920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fb89da8b96bf'
+down_revision = '0fe59c9800dc'
+branch_labels = None
+depends_on = None
+
+
+def _copy_followers(primary_key):
+    # followers can't gain a primary key in place on SQLite, so copy the
+    # distinct, non-null rows into a new table and swap it in
+    op.create_table('followers_tmp',
+    sa.Column('follower_id', sa.Integer(), nullable=not primary_key),
+    sa.Column('followed_id', sa.Integer(), nullable=not primary_key),
+    sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['user.id'], ),
+    *([sa.PrimaryKeyConstraint('follower_id', 'followed_id')] if primary_key else [])
+    )
+    op.execute('INSERT INTO followers_tmp (follower_id, followed_id) '
+               'SELECT DISTINCT follower_id, followed_id FROM followers '
+               'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL')
+    op.drop_table('followers')
+    op.rename_table('followers_tmp', 'followers')
+
+
+def upgrade():
+    _copy_followers(primary_key=True)
+    op.create_index('ix_followers_followed_id_follower_id', 'followers', ['followed_id', 'follower_id'], unique=False)
+
+    op.execute('DELETE FROM post_like WHERE id NOT IN '
+               '(SELECT MIN(id) FROM post_like GROUP BY user_id, post_id)')
+    op.create_index('ix_post_like_user_id_post_id', 'post_like', ['user_id', 'post_id'], unique=True)
+    op.create_index(op.f('ix_post_like_post_id'), 'post_like', ['post_id'], unique=False)
+    op.create_index(op.f('ix_comment_post_id'), 'comment', ['post_id'], unique=False)
+    op.create_index('ix_post_user_id_timestamp', 'post', ['user_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_post_user_id_timestamp', table_name='post')
+    op.drop_index(op.f('ix_comment_post_id'), table_name='comment')
+    op.drop_index(op.f('ix_post_like_post_id'), table_name='post_like')
+    op.drop_index('ix_post_like_user_id_post_id', table_name='post_like')
+
+    op.drop_index('ix_followers_followed_id_follower_id', table_name='followers')
+    _copy_followers(primary_key=False)